@@ -1,9 +1,21 @@
 import json
 import logging
-import time
+
+# orjson decodes responses several times faster, but it is optional.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from requests import Request, Session
-from requests.exceptions import ConnectionError, HTTPError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
 
+import metrics
+import tracing
+from clock import Clock
+from recorder import client_id
+from retry import RetryPolicy
+from scheduler import ERESULT_EXPIRED, RttEstimator
 from version import __version__ as version
 
 
@@ -23,17 +35,58 @@ _METHOD_REPORTBOSSDAMAGE = 'ITerritoryControlMinigameService/ReportBossDamage'
 _METHOD_LEAVEGAME = 'IMiniGameService/LeaveGame'
 
 
+def new_session(pool_size=10):
+    session = Session()
+    session.headers.update({'User-Agent': _USER_AGENT})
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def decode_json(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
 class Client():
-    def __init__(self, token):
+    def __init__(self, token, session=None, cache=None, retry_policy=None, host=_HOST, clock=None,
+                 rate_limiter=None, recorder=None):
         self.token = token
-        self.session = Session()
-        self.session.headers.update({'User-Agent': _USER_AGENT})
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+        # Point host at mockserver.py to run without the live service.
+        self.host = host.rstrip('/')
+        # The same policy is used by Bot when it retries a bad eresult, and it
+        # can be shared between clients so they share one circuit breaker.
+        if retry_policy is None:
+            retry_policy = RetryPolicy(clock=clock)
+        self.retry_policy = retry_policy
+        # Round-trip time of successful requests, used to time ReportScore.
+        self.rtt = RttEstimator()
+        # An optional cache.GalaxyCache that can be shared between clients.
+        self.cache = cache
+        # An optional ratelimit.RateLimiter every request waits on.  Share it
+        # between clients to give them one budget.
+        self.rate_limiter = rate_limiter
+        # An optional recorder.Recorder every response and failed attempt is
+        # written to, for replay.py.  Like the session, it can be shared between clients.
+        self.recorder = recorder
+        self._client_id = client_id(token)
+        # Tracked so the cache can be told which planet a zone change is on.
+        self._active_planet = None
+        # Several clients can share one session, and therefore one connection
+        # pool, when running many accounts from the same process.
+        if session is None:
+            session = new_session()
+        self.session = session
 
         self.logger = logging.getLogger(__name__)
 
-    @staticmethod
-    def _build_url(path):
-        url = f'{_HOST}/{path}/{_VERSION}/'
+    def _build_url(self, path):
+        url = f'{self.host}/{path}/{_VERSION}/'
         return url
 
     def _get(self, url, params=None):
@@ -46,42 +99,108 @@ class Client():
         resp = self._execute_request(req)
         return resp
 
+    @staticmethod
+    def _endpoint(url):
+        # https://host/IService/Method/v0001/ -> Method
+        return url.rstrip('/').split('/')[-2]
+
     def _execute_request(self, request):
         prepped = self.session.prepare_request(request)
+        endpoint = Client._endpoint(request.url)
+        breaker = self.retry_policy.breaker
 
-        attempts = 0
-        max_attempts = 10
-        fail_wait = 5
-
-        while attempts < max_attempts:
-            try:
-                resp = self.session.send(prepped)
-                resp.raise_for_status()
-                break
-            except HTTPError:
-                self.logger.debug(f'HTTPError - Retrying request in {fail_wait} seconds...')
-            except ConnectionError:
-                self.logger.debug(f'ConnectionError - Retrying request in {fail_wait} seconds...')
+        # Entering the scope joins the one Bot._call_api started, if any, so
+        # the deadline covers both layers.
+        with tracing.span(endpoint), self.retry_policy.scope() as retry:
+            retry.bind(endpoint)
+            while True:
+                if self.rate_limiter is not None:
+                    waited = self.rate_limiter.acquire(endpoint)
+                    if waited > 0:
+                        metrics.api_rate_limit_seconds.inc(waited, endpoint=endpoint)
+                breaker.before_request()
+                sent_time = self.clock.time()
+                sent_at = self.clock.monotonic()
+                try:
+                    resp = self.session.send(prepped, timeout=retry.timeout())
+                    resp.raise_for_status()
+                    self.rtt.record(self.clock.monotonic() - sent_at)
+                    breaker.record_success()
+                    break
+                except RequestException as e:
+                    breaker.record_failure()
+                    metrics.api_failures.inc(endpoint=endpoint, reason=type(e).__name__)
+                    if self.recorder is not None:
+                        self._record_failure(request, endpoint, e, sent_time, self.clock.monotonic() - sent_at)
+                    fail_wait = retry.next_delay()
+                    if fail_wait is None:
+                        raise Exception('Unable to recover from failed request attempts') from e
+                    self.logger.debug(f'{type(e).__name__} on {endpoint} - Retrying request in {fail_wait:.1f} seconds...')
+                    metrics.api_retries.inc(endpoint=endpoint, reason=type(e).__name__)
+                except BaseException:
+                    # Anything else still has to give back the half-open
+                    # trial, or the breaker would never let a request through
+                    # again.
+                    breaker.release()
+                    raise
+                finally:
+                    metrics.api_request_seconds.observe(self.clock.monotonic() - sent_at, endpoint=endpoint)
 
-            attempts += 1
-            time.sleep(fail_wait)
-            fail_wait += 5
-
-        if attempts == max_attempts:
-            raise Exception('Unable to recover from failed request attempts')
+                metrics.api_backoff_seconds.inc(fail_wait, endpoint=endpoint)
+                self.clock.sleep(fail_wait)
 
+        # An empty body counts as an empty response, so an error without one
+        # still gets to the eresult handling.
         json = {}
-        if resp.headers.get('Content-Type', '').find('application/json') > -1:
-            json = resp.json().get('response')
+        if resp.headers.get('Content-Type', '').find('application/json') > -1 and len(resp.content) > 0:
+            json = decode_json(resp.content).get('response', {})
 
         eresult = resp.headers.get('X-eresult', -1)
+        metrics.api_eresults.inc(endpoint=endpoint, eresult=eresult)
         if eresult != '1':
             json = resp.headers.get('X-error_message', 'unknown error')
 
+        if self.recorder is not None:
+            self._record(request, endpoint, resp.status_code, eresult, json, sent_time,
+                         self.clock.monotonic() - sent_at)
         return json, eresult
 
+    def _record_failure(self, request, endpoint, error, sent_time, elapsed):
+        # A failed attempt, whether or not it will be retried.  HTTP errors
+        # still have a status and maybe an eresult; timeouts and connection
+        # errors have neither.
+        status = None
+        eresult = None
+        if error.response is not None:
+            status = error.response.status_code
+            eresult = error.response.headers.get('X-eresult')
+        self._record(request, endpoint, status, eresult, f'{type(error).__name__}: {error}', sent_time, elapsed)
+
+    def _record(self, request, endpoint, status, eresult, body, sent_time, elapsed):
+        params = {}
+        for source in (request.params, request.data):
+            if source:
+                params.update(source)
+        params.pop('access_token', None)
+        self.recorder.record({
+            't': sent_time,
+            'elapsed': elapsed,
+            'client': self._client_id,
+            'endpoint': endpoint,
+            'method': request.method,
+            'params': params,
+            'status': status,
+            'eresult': eresult,
+            'body': body,
+        })
+
     def get_planets(self, active_only=1):
-        url = Client._build_url(_METHOD_GETPLANETS)
+        if self.cache is not None:
+            return self.cache.get_planets(self._get_planets, active_only)
+        return self._get_planets(active_only)
+
+    def _get_planets(self, active_only):
+        url = self._build_url(_METHOD_GETPLANETS)
         params = {
             'active_only': active_only,
             'language': 'english',
@@ -91,7 +210,12 @@ class Client():
         return planets, eresult
 
     def get_planet(self, planet_id):
-        url = Client._build_url(_METHOD_GETPLANET)
+        if self.cache is not None:
+            return self.cache.get_planet(self._get_planet, planet_id)
+        return self._get_planet(planet_id)
+
+    def _get_planet(self, planet_id):
+        url = self._build_url(_METHOD_GETPLANET)
         params = {
             'id': planet_id,
             'language': 'english',
@@ -101,33 +225,44 @@ class Client():
         return planet, eresult
 
     def get_player_info(self):
-        url = Client._build_url(_METHOD_GETPLAYERINFO)
+        url = self._build_url(_METHOD_GETPLAYERINFO)
         params = {
             'access_token': self.token
         }
         json, eresult = self._post(url, params)
+        if eresult == '1':
+            self._active_planet = json.get('active_planet')
         return json, eresult
 
     def join_planet(self, planet_id):
-        url = Client._build_url(_METHOD_JOINPLANET)
+        url = self._build_url(_METHOD_JOINPLANET)
         params = {
             'access_token': self.token,
             'id': planet_id,
         }
         json, eresult = self._post(url, params)
+        if eresult == '1':
+            self._active_planet = planet_id
         return json, eresult
 
     def join_zone(self, zoneid):
-        url = Client._build_url(_METHOD_JOINZONE)
+        url = self._build_url(_METHOD_JOINZONE)
         params = {
             'access_token': self.token,
             'zone_position': zoneid,
         }
         json, eresult = self._post(url, params)
+        # The response shows how far along the zone really is.  The cached
+        # planet is only dropped if it disagrees.
+        if self.cache is not None and self._active_planet is not None:
+            if eresult == '1':
+                self.cache.update_zone(self._active_planet, json.get('zone_info'))
+            elif eresult == ERESULT_EXPIRED:
+                self.cache.invalidate_planet(self._active_planet)
         return json, eresult
 
     def join_boss_zone(self, zoneid):
-        url = Client._build_url(_METHOD_JOINBOSSZONE)
+        url = self._build_url(_METHOD_JOINBOSSZONE)
         params = {
             'access_token': self.token,
             'zone_position': zoneid,
@@ -136,7 +271,7 @@ class Client():
         return json, eresult
 
     def represent_clan(self, clan_id):
-        url = Client._build_url(_METHOD_REPRESENTCLAN)
+        url = self._build_url(_METHOD_REPRESENTCLAN)
         params = {
             'access_token': self.token,
             'clad_id': clan_id,
@@ -145,16 +280,20 @@ class Client():
         return json, eresult
 
     def report_score(self, score):
-        url = Client._build_url(_METHOD_REPORTSCORE)
+        url = self._build_url(_METHOD_REPORTSCORE)
         params = {
             'access_token': self.token,
             'score': score,
         }
         json, eresult = self._post(url, params)
+        # A zone captured during the round is the one change the response
+        # tells us about.  Our own progress can wait for the TTL.
+        if eresult == ERESULT_EXPIRED and self.cache is not None and self._active_planet is not None:
+            self.cache.invalidate_planet(self._active_planet)
         return json, eresult
 
     def report_boss_damage(self, use_heal_ability, damage_to_boss, damage_taken):
-        url = Client._build_url(_METHOD_REPORTBOSSDAMAGE)
+        url = self._build_url(_METHOD_REPORTBOSSDAMAGE)
         params = {
             'access_token': self.token,
             'use_heal_ability': use_heal_ability,
@@ -165,10 +304,12 @@ class Client():
         return json, eresult
 
     def leave_game(self, game_id):
-        url = Client._build_url(_METHOD_LEAVEGAME)
+        url = self._build_url(_METHOD_LEAVEGAME)
         params = {
             'access_token': self.token,
             'gameid': game_id
         }
         json, eresult = self._post(url, params)
+        if eresult == '1' and game_id == self._active_planet:
+            self._active_planet = None
         return json, eresult
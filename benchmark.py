@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+# Micro-benchmarks for the parsing, ranking and rendering hot paths.
+#
+#   $ python benchmark.py --sizes 10 100 1000 10000 --output before.json
+#   $ python benchmark.py --output after.json --compare before.json
+#
+# Galaxies are generated from a fixed seed, so runs are comparable between
+# commits.  --payload adds a benchmark on recorded API responses: a JSON file
+# with a "planets" list of GetPlanet planets, and optionally a "player"
+# GetPlayerInfo response and a "boss" ReportBossDamage response.
+
+import argparse
+import gc
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import api
+import display
+from bot import ZONE_PRIORITY, Bot, Planet, Player, Zone
+from coordinator import ZoneAssigner
+from galaxy import GalaxyIndex
+
+ZONES_PER_PLANET = 96
+
+
+def make_zone_json(position, planet_id, rng):
+    zone_type = 4 if rng.random() < 0.01 else 3
+    zone = {
+        'zone_position': position,
+        'gameid': str(rng.randint(10**9, 10**10)),
+        'type': zone_type,
+        'difficulty': rng.choice([1, 1, 1, 2, 2, 3]),
+        'captured': rng.random() < 0.3,
+        'capture_progress': rng.random(),
+    }
+    if zone_type == 4:
+        zone['boss_active'] = True
+    return zone
+
+
+def make_planet_json(planet_id, rng):
+    return {
+        'id': str(planet_id),
+        'state': {
+            'name': f'#TerritoryControl_Planet{planet_id}',
+            'active': True,
+            'captured': False,
+            'capture_progress': rng.random(),
+            'current_players': rng.randint(0, 50000),
+        },
+        'zones': [make_zone_json(i, planet_id, rng) for i in range(ZONES_PER_PLANET)],
+    }
+
+
+def make_galaxy_json(size, seed=0):
+    rng = random.Random(seed)
+    return [make_planet_json(planet_id, rng) for planet_id in range(1, size + 1)]
+
+
+def make_player_json():
+    return {
+        'active_planet': '12',
+        'time_on_planet': 3600,
+        'active_zone_game': '1234567890',
+        'active_zone_position': '42',
+        'time_in_zone': 30,
+        'score': '1234567',
+        'level': 12,
+        'next_level_score': '2400000',
+    }
+
+
+def make_boss_json(players=30, seed=0):
+    rng = random.Random(seed)
+    return {
+        'boss_status': {
+            'boss_hp': 3000000,
+            'boss_max_hp': 5000000,
+            'boss_players': [{
+                'accountid': i,
+                'name': f'player {i}',
+                'hp': rng.randint(0, 100000),
+                'max_hp': 100000,
+                'xp_earned': rng.randint(0, 1000000),
+                'time_last_heal': int(time.time()) - rng.randint(0, 300),
+            } for i in range(players)],
+        },
+        'waiting_for_players': False,
+        'game_over': False,
+        'num_laser_uses': 12,
+        'num_team_heals': 34,
+    }
+
+
+def measure(func, repeat, number=1):
+    # Returns (timings, peak traced memory).  Timings are per call and taken
+    # without tracemalloc running, since it slows everything down.
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings, peak
+
+
+def summarize(timings, peak):
+    return {
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'max_s': max(timings),
+        'peak_bytes': peak,
+    }
+
+
+def galaxy_benchmarks(galaxy_json):
+    body = json.dumps({'response': {'planets': galaxy_json}}).encode('utf-8')
+    planets = [Planet.from_json(p) for p in galaxy_json]
+    zones_by_planet = [[Zone.from_json(z) for z in p['zones']] for p in galaxy_json]
+
+    def index_update():
+        galaxy = GalaxyIndex(ZONE_PRIORITY)
+        galaxy.update(planets)
+
+    warm = GalaxyIndex(ZONE_PRIORITY)
+    warm.update(planets)
+
+    def index_reapply():
+        # Same planets again, which is the common case between rounds.
+        warm.update(planets)
+        warm.best_planet()
+
+    # In a fleet every bot parses its own planets into the shared index.
+    other_planets = [Planet.from_json(p) for p in galaxy_json]
+
+    def index_fleet():
+        warm.update(other_planets)
+        warm.update(planets)
+
+    # Twenty accounts already placed, and one more picking a zone.
+    assigner = ZoneAssigner(warm)
+    for account_id in range(20):
+        assigner.assign(account_id, horizon=60)
+
+    return {
+        'json.loads': lambda: json.loads(body),
+        'api.decode_json': lambda: api.decode_json(body),
+        'Zone.from_json': lambda: [Zone.from_json(z) for p in galaxy_json for z in p['zones']],
+        'Planet.from_json': lambda: [Planet.from_json(p) for p in galaxy_json],
+        'Planet.update_from_json': lambda: [p.update_from_json(j) for p, j in zip(planets, galaxy_json)],
+        'Planet._group_zones': lambda: [Planet._group_zones(z) for z in zones_by_planet],
+        # best_planet sorts in place, which would reorder the planets the
+        # index benchmarks use.
+        'Bot.best_planet': lambda: Bot.best_planet(list(planets)),
+        'Planet.best_zone': lambda: [p.best_zone() for p in planets],
+        'GalaxyIndex.update': index_update,
+        'GalaxyIndex.update (unchanged)': index_reapply,
+        'GalaxyIndex.update (two bots)': index_fleet,
+        'ZoneAssigner.assign': lambda: assigner.assign(20, horizon=60),
+        'display.planets': lambda: display.planets(planets),
+    }
+
+
+def run(sizes, repeat, payload=None, seed=0):
+    # display logs through the logging module.  Send it nowhere, but keep
+    # INFO enabled so the formatting work is still done.
+    display.logger.propagate = False
+    display.logger.addHandler(logging.NullHandler())
+    display.logger.setLevel(logging.INFO)
+
+    results = {}
+
+    player_json = make_player_json()
+    timings, peak = measure(lambda: Player.from_json(player_json), repeat, number=1000)
+    results['Player.from_json'] = {'synthetic': summarize(timings, peak)}
+
+    boss_json = make_boss_json(seed=seed)
+    timings, peak = measure(lambda: display.boss_progress(boss_json, 0), repeat, number=100)
+    results['display.boss_progress'] = {'synthetic-30': summarize(timings, peak)}
+
+    galaxies = [(f'synthetic-{size}', make_galaxy_json(size, seed)) for size in sizes]
+    if payload is not None:
+        galaxies.append(('recorded', payload['planets']))
+        if 'player' in payload:
+            timings, peak = measure(lambda: Player.from_json(payload['player']), repeat, number=1000)
+            results['Player.from_json']['recorded'] = summarize(timings, peak)
+        if 'boss' in payload:
+            timings, peak = measure(lambda: display.boss_progress(payload['boss'], 0), repeat, number=100)
+            results['display.boss_progress']['recorded'] = summarize(timings, peak)
+
+    for label, galaxy_json in galaxies:
+        for name, func in galaxy_benchmarks(galaxy_json).items():
+            timings, peak = measure(func, repeat)
+            results.setdefault(name, {})[label] = summarize(timings, peak)
+            print(f'{name:32} {label:18} {statistics.median(timings)*1000:10.3f} ms  {peak/1024:10.1f} KiB')
+
+    return results
+
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    print()
+    print(f'{"Benchmark":32} {"Dataset":18} {"Before":>12} {"After":>12} {"Change":>8}')
+    for name, datasets in results.items():
+        for label, after in datasets.items():
+            before = baseline.get('results', {}).get(name, {}).get(label)
+            if before is None:
+                continue
+            change = after['median_s'] / before['median_s'] - 1
+            print(f'{name:32} {label:18} {before["median_s"]*1000:9.3f} ms {after["median_s"]*1000:9.3f} ms {change*100:+7.1f}%')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the bot\'s hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='numbers of planets in the synthetic galaxies')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--payload', help='JSON file of recorded API responses')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='a previous --output file to compare against')
+    args = parser.parse_args()
+
+    payload = None
+    if args.payload is not None:
+        with open(args.payload, encoding='utf-8') as f:
+            payload = json.load(f)
+
+    results = run(args.sizes, args.repeat, payload, args.seed)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': args.sizes,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
@@ -1,8 +1,15 @@
+import contextvars
 import logging
-import time
-from datetime import datetime, timedelta
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import display
+import metrics
+import tracing
+from galaxy import GalaxyIndex
+from retry import CircuitOpenError
+from scheduler import ERESULT_EXPIRED, ERESULT_TIME_NOT_SYNCED, BossPacer, ScoreScheduler
 
 # TODO: shouldn't these be a part of the Zone class?
 ZONE_LOW = 1
@@ -10,213 +17,706 @@ ZONE_MEDIUM = 2
 ZONE_HIGH = 3
 ZONE_BOSS = 4
 
+# Zone difficulties from most to least wanted.
+ZONE_PRIORITY = [ZONE_BOSS, ZONE_HIGH, ZONE_MEDIUM, ZONE_LOW]
+
 
 class Bot():
-    def __init__(self, api_client, account_id):
+    def __init__(self, api_client, account_id, planet_workers=8, clock=None, galaxy=None,
+                 reconcile_interval=600, heals=None, assigner=None, boss_watcher=None,
+                 boss_preempt=1.0, planet_max_age=300, checkpoint=None, planet_pool=None):
         self.api = api_client
         self.account_id = account_id
+        # Share the client's clock unless told otherwise, so a simulated clock
+        # moves the bot and its retries together.
+        if clock is None:
+            clock = api_client.clock
+        self.clock = clock
+        # Maximum number of GetPlanet requests to have in flight at once.
+        # Setting this to 1 fetches the planets one after another.
+        self.planet_workers = max(1, planet_workers)
+        # An executor shared with other bots to fetch planet details on, so a
+        # fleet doesn't start planet_workers threads per account.  None
+        # starts them for each fetch.
+        self.planet_pool = planet_pool
+        # Planets we have details for, by id, as (GetPlanets summary, Planet,
+        # monotonic time fetched).  GetPlanet is only asked again for planets
+        # whose summary changed or whose details are older than
+        # planet_max_age seconds, and the Planet is updated in place.
+        self.planet_max_age = planet_max_age
+        self._known_planets = {}
+        # Ranks the planets and zones we know about.  Several bots can share
+        # one index.
+        if galaxy is None:
+            galaxy = GalaxyIndex(ZONE_PRIORITY, self.clock)
+        self.galaxy = galaxy
+        # A HealCoordinator shared with our other accounts, so we take turns
+        # healing when we end up in the same boss game.  None heals whenever
+        # we can.
+        self.heals = heals
+        # A ZoneAssigner shared with our other accounts that picks our zones
+        # so the fleet spreads out.  None picks the best zone from galaxy.
+        self.assigner = assigner
+        # A BossWatcher that wakes us up during a round when a boss spawns.
+        # We leave the round for the boss if less than boss_preempt of it has
+        # passed, so 1 always goes and 0 always finishes the round first.
+        self.boss_watcher = boss_watcher
+        self.boss_preempt = boss_preempt
+        self._boss_alert = None
+        self._last_boss_game = None
+        if boss_watcher is not None and boss_preempt > 0:
+            self._boss_alert = boss_watcher.subscribe()
 
         # These will get populated when run is called
         self.planet = None
         self.zone = None
         self.player = None
 
+        # The next round's (planet, zone), picked during the current round,
+        # or the future that is still picking it.
+        self._next_target = None
+        self._pending_target = None
+        self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        # Monotonic time the last score was reported at, and how long it took
+        # from then until we were playing again.
+        self._reported_at = None
+        self.last_turnaround = None
+        self._started_at = self.clock.monotonic()
+        # XP earned by this bot.  The bot_xp counter keeps counting across
+        # restarts of the account, so it can't be divided by our uptime.
+        self._xp = 0
+
+        # Decides when ReportScore goes out, based on when we got into the
+        # zone and how long requests are taking.
+        self.scheduler = ScoreScheduler(self.clock, self.api.rtt)
+
+        # The player is tracked locally from the responses to our own calls.
+        # GetPlayerInfo is only asked at startup, after something went wrong,
+        # and every reconcile_interval seconds in case we drifted anyway.
+        self.reconcile_interval = reconcile_interval
+        self._player_refreshed_at = None
+        self._reconcile = True
+
+        # A checkpoint.Checkpoint the round we are in is saved to, so if we
+        # are restarted in the middle of it we can finish it instead of
+        # leaving.  None turns this off.
+        self.checkpoint = checkpoint
+        self._resume_state = None
+        # Set by _resume() for join_target() and play_boss_zone().
+        self._resumed_at = None
+        self._resumed_heal = None
+        self._first_round_at = None
+
         self.logger = logging.getLogger(__name__)
 
     def run(self):
         display.welcome()
-
-        while True:
-            player_json = self._call_api(self.api.get_player_info)
-            self.logger.debug(player_json)
-            self.player = Player.from_json(player_json)
-            display.player_info(self.player)
-
-            planets = self.potential_planets()
-            if len(planets) == 0:
+        if self.checkpoint is not None:
+            self._resume_state = self.checkpoint.load()
+
+        try:
+            while True:
+                try:
+                    with tracing.span('round', account=self.account_id):
+                        more = self.play_round()
+                    if not more:
+                        if self.checkpoint is not None:
+                            self.checkpoint.clear()
+                        break
+                except CircuitOpenError as e:
+                    # The API is down for everyone.  Sit it out instead of
+                    # burning through retries, with some jitter so a fleet
+                    # doesn't come back all at once.
+                    wait = e.retry_after + self.api.retry_policy.backoff(2)
+                    display.message(f'API is not responding, waiting {wait:.0f} seconds...')
+                    self._reconcile = True
+                    self._sleep(wait, 'circuit')
+        finally:
+            # Don't leave our zone counted against the rest of the fleet.
+            if self.assigner is not None:
+                self.assigner.release(self.account_id)
+            if self._boss_alert is not None:
+                self.boss_watcher.unsubscribe(self._boss_alert)
+
+    def play_round(self):
+        # Plays a single zone or boss game.  Returns False when there is
+        # nothing left to play.
+        target = self._next_target
+        self._next_target = None
+        if self._pending_target is not None:
+            target = self._pending_target.result()
+            self._pending_target = None
+
+        if target is None and self._resume_state is not None:
+            target = self._resume()
+        if target is None:
+            if self._player_due():
+                self.refresh_player()
+            target = self.choose_target()
+            if target is None:
                 display.message('No more planets to conquer. Exiting...')
-                break
-            display.planets(planets)
-            self.planet = self.best_planet(planets)
-            self.zone = self.planet.best_zone()
-
-            # Join the best planet if we need to.
-            if self.player.active_planet != self.planet.id:
-                # Leave the current Zone if we've already joined one.
-                if self.player.active_zone_game is not None:
-                    self.logger.debug(f'Leaving Zone {self.player.active_zone} ({self.player.active_zone_game}) before leaving Planet {self.player.active_planet}')
-                    self._call_api(self.api.leave_game, self.player.active_zone_game)
-                # Leave the current Planet if we've already joined one.
-                if self.player.active_planet is not None:
-                    self.logger.debug(f'Leaving Planet {self.player.active_planet} before joining Planet {self.planet.id}')
-                    self._call_api(self.api.leave_game, self.player.active_planet)
-                self.logger.debug(f'Joining planet {self.planet.id}')
-                self._call_api(self.api.join_planet, self.planet.id)
-
-            # Join the best zone if we aren't already there.
-            if self.player.active_zone_game != self.zone.game_id:
-                # Leave the current Zone if we've already joined one.
-                if self.player.active_zone_game is not None:
-                    self.logger.debug(f'Leaving Zone {self.player.active_zone} ({self.player.active_zone_game}) on Planet {self.player.active_planet}')
-                    self._call_api(self.api.leave_game, self.player.active_zone_game)
-                if self.zone.boss_active:
-                    self.logger.debug(f'Joining boss Zone {self.zone.id} on Planet {self.planet.id}')
-                    self._call_api(self.api.join_boss_zone, self.zone.id)
-                else:
-                    self.logger.debug(f'Joining Zone {self.zone.id} on Planet {self.planet.id}')
-                    self._call_api(self.api.join_zone, self.zone.id)
-                    # NOTE:  This is a pretty dirty hack, but it needs to happen
-                    # to make sure we don't report a zone score too early.  The
-                    # time in zone is important when we choose the same zone
-                    # after restarting the bot, resulting in being out of sync
-                    # with the server.
-                    self.player.time_in_zone = 0
-
-            display.join_zone_status(self.player, self.planet, self.zone)
-
+                return False
+            self.planet, self.zone = target
+            joined = self.join_target()
+        else:
+            # The target was picked while the last round was running, or is
+            # the round we were in before a restart, so join right away.  If
+            # the player is due a check, that can wait until the round timer
+            # is already running.
+            self.planet, self.zone = target
+            joined = self.join_target()
+            if self._player_due():
+                self.refresh_player()
+
+        if not joined:
+            display.message(f'Zone {self.zone.id} on Planet {self.planet.id} was captured before we got in')
+            return True
+
+        display.join_zone_status(self.player, self.planet, self.zone)
+
+        if self.zone.boss_active:
+            self.play_boss_zone()
+            # Boss damage reports don't tell us our score, so ask.
+            self._reconcile = True
+            metrics.bot_rounds.inc(account=self.account_id, kind='boss')
+        else:
+            kind = 'zone' if self.play_zone() else 'preempted'
+            metrics.bot_rounds.inc(account=self.account_id, kind=kind)
+
+        metrics.bot_uptime_seconds.set(self.clock.monotonic() - self._started_at, account=self.account_id)
+        return True
+
+    def _sleep(self, seconds, reason, interrupt=None):
+        # Returns True if interrupt, an Event, cut the sleep short.
+        if seconds <= 0:
+            return False
+        if interrupt is None:
+            with tracing.span('wait', reason=reason):
+                self.clock.sleep(seconds)
+            metrics.bot_sleep_seconds.inc(seconds, account=self.account_id, reason=reason)
+            return False
+        start = self.clock.monotonic()
+        with tracing.span('wait', reason=reason):
+            interrupted = self.clock.wait(interrupt, seconds)
+        metrics.bot_sleep_seconds.inc(self.clock.monotonic() - start, account=self.account_id, reason=reason)
+        return interrupted
+
+    def _record_xp(self, xp):
+        metrics.bot_xp.inc(xp, account=self.account_id)
+        self._xp += xp
+        hours = (self.clock.monotonic() - self._started_at) / 3600
+        if hours > 0:
+            xp_per_hour = self._xp / hours
+            metrics.bot_xp_per_hour.set(xp_per_hour, account=self.account_id)
+
+    def _player_due(self):
+        if self.player is None or self._reconcile:
+            return True
+        return self.clock.monotonic() - self._player_refreshed_at >= self.reconcile_interval
+
+    @tracing.traced('player refresh')
+    def refresh_player(self):
+        player_json = self._call_api(self.api.get_player_info)
+        self._player_refreshed_at = self.clock.monotonic()
+        self._reconcile = False
+        self.logger.debug(player_json)
+        player = Player.from_json(player_json)
+        # Zone rounds are counted as they are reported.  Anything else, like
+        # boss XP, shows up as a difference from what we expected.
+        if self.player is not None and player.score > self.player.score:
+            self._record_xp(player.score - self.player.score)
+        self.player = player
+        display.player_info(self.player)
+
+    def choose_target(self):
+        # Returns the (planet, zone) to play next, or None if there are no
+        # planets left.
+        planets = self.potential_planets()
+        if len(planets) == 0:
+            return None
+        display.planets(planets)
+        with tracing.span('ranking'):
+            self.galaxy.update(planets)
+            if self.assigner is not None:
+                return self.assigner.assign(self.account_id, horizon=self.scheduler.horizon())
+            planet = self.galaxy.best_planet()
+            zone = self.galaxy.best_zone(planet.id, self.scheduler.horizon())
+        return planet, zone
+
+    @tracing.traced('join')
+    def join_target(self):
+        # Returns False if the planet or zone was captured before we could
+        # join it.
+        # Join the best planet if we need to.
+        if self.player.active_planet != self.planet.id:
+            # Leave the current Zone if we've already joined one.
+            if self.player.active_zone_game is not None:
+                self.logger.debug(f'Leaving Zone {self.player.active_zone} ({self.player.active_zone_game}) before leaving Planet {self.player.active_planet}')
+                self._call_api(self.api.leave_game, self.player.active_zone_game)
+                self.player.left_zone()
+            # Leave the current Planet if we've already joined one.
+            if self.player.active_planet is not None:
+                self.logger.debug(f'Leaving Planet {self.player.active_planet} before joining Planet {self.planet.id}')
+                self._call_api(self.api.leave_game, self.player.active_planet)
+                self.player.left_planet()
+            self.logger.debug(f'Joining planet {self.planet.id}')
+            if not self._join(self.api.join_planet, self.planet.id):
+                return False
+            self.player.joined_planet(self.planet.id)
+
+        # Join the best zone if we aren't already there.
+        if self.player.active_zone_game != self.zone.game_id:
+            # Leave the current Zone if we've already joined one.
+            if self.player.active_zone_game is not None:
+                self.logger.debug(f'Leaving Zone {self.player.active_zone} ({self.player.active_zone_game}) on Planet {self.player.active_planet}')
+                self._call_api(self.api.leave_game, self.player.active_zone_game)
+                self.player.left_zone()
             if self.zone.boss_active:
-                self.play_boss_zone()
+                self.logger.debug(f'Joining boss Zone {self.zone.id} on Planet {self.planet.id}')
+                if not self._join(self.api.join_boss_zone, self.zone.id):
+                    return False
             else:
-                self.play_zone()
+                self.logger.debug(f'Joining Zone {self.zone.id} on Planet {self.planet.id}')
+                if not self._join(self.api.join_zone, self.zone.id):
+                    return False
+                self.scheduler.joined()
+            self.player.joined_zone(self.zone)
+        elif self._resumed_at is not None:
+            # We are already in the zone because the bot restarted in the
+            # middle of a round, and the checkpoint says when it started.
+            self.scheduler.resume(self._resumed_at)
+            self._resumed_at = None
+        else:
+            # We are already in the zone but have no checkpoint for it, so
+            # work out when we got in from what GetPlayerInfo told us.  It is
+            # only good to the second.
+            self.scheduler.joined(self._player_refreshed_at, self.player.time_in_zone)
+        self._save_checkpoint()
+
+        if self._first_round_at is None:
+            self._first_round_at = self.clock.monotonic()
+            startup = self._first_round_at - self._started_at
+            self.logger.debug(f'First round started {startup:.2f} seconds after starting')
+            metrics.bot_startup_seconds.set(startup, account=self.account_id)
+
+        # Turnaround is the time between reporting a score and being back in
+        # a zone, which is time the next round isn't running.
+        if self._reported_at is not None:
+            self.last_turnaround = self.clock.monotonic() - self._reported_at
+            self._reported_at = None
+            self.logger.debug(f'Round turnaround took {self.last_turnaround:.2f} seconds')
+            metrics.bot_round_turnaround_seconds.observe(self.last_turnaround, account=self.account_id)
+        return True
+
+    def _resume(self):
+        # Returns the (planet, zone) of the round the checkpoint says we were
+        # in, if GetPlayerInfo says we still are, or None to pick a new one.
+        # Only that planet is fetched.
+        state = self._resume_state
+        self._resume_state = None
+        if self._player_due():
+            self.refresh_player()
+        game_id = state.get('game')
+        if game_id is None or self.player.active_zone_game != game_id:
+            return None
+        planet = self._fetch_planet(state.get('planet'))
+        zone = planet.zone(state.get('zone'))
+        if zone is None or zone.game_id != game_id:
+            return None
+
+        self.galaxy.apply(planet)
+        if self.assigner is not None:
+            self.assigner.claim(self.account_id, planet.id, zone.id)
+        # Saved as wall clock time, since the monotonic clock starts over
+        # with the process.
+        if state.get('joined_at') is not None:
+            self._resumed_at = self.clock.monotonic() - (self.clock.time() - state.get('joined_at'))
+        self._resumed_heal = state.get('last_heal')
+        display.message(f'Resuming Zone {zone.id} on Planet {planet.id}')
+        return planet, zone
+
+    def _save_checkpoint(self, last_heal=None):
+        if self.checkpoint is None:
+            return
+        joined_at = None
+        if not self.zone.boss_active and self.scheduler.accepted_at is not None:
+            joined_at = self.clock.time() - (self.clock.monotonic() - self.scheduler.accepted_at)
+        self.checkpoint.save({
+            'planet': self.planet.id,
+            'zone': self.zone.id,
+            'game': self.zone.game_id,
+            'joined_at': joined_at,
+            'last_heal': last_heal,
+        })
+
+    def _join(self, func, *args):
+        # Like _call_api, but returns False instead of retrying when what we
+        # are joining has been captured.
+        json, eresult = func(*args)
+        if eresult == ERESULT_EXPIRED:
+            self.logger.debug(f'Calling {func.__name__}() gave eresult: {eresult} - {json}')
+            self._reconcile = True
+            return False
+        if eresult != '1':
+            self._call_api(func, *args)
+        return True
 
     def _call_api(self, func, *args, **kwargs):
         # TODO: what about not throwing an exception when it fails?  what if the
         # caller wants to handle the error better than this?
-        attempts = 0
-        max_attempts = 5
-        fail_wait = 1
-        while attempts < max_attempts:
-            json, eresult = func(*args, **kwargs)
-            if eresult != '1':
+        # Retrying a bad eresult shares the client's retry policy, and the
+        # client's own retries run inside this scope, so the whole call is
+        # bound by one deadline.
+        with self.api.retry_policy.scope() as retry:
+            while True:
+                json, eresult = func(*args, **kwargs)
+                if eresult == '1':
+                    break
                 self.logger.debug(f'Calling {func.__name__}() gave eresult: {eresult} - {json}')
-                self.logger.debug(f'Retrying API call in {fail_wait} seconds...')
-                attempts += 1
-                time.sleep(fail_wait)
-                fail_wait *= 2
-            else:
-                break
-
-        if attempts == max_attempts:
-            raise Exception('Unable to recover from failed API call attempts')
+                # The server disagreed with us, so our idea of the player may
+                # be wrong too.
+                self._reconcile = True
+                fail_wait = retry.next_delay()
+                if fail_wait is None:
+                    raise Exception('Unable to recover from failed API call attempts')
+                self.logger.debug(f'Retrying API call in {fail_wait:.1f} seconds...')
+                metrics.api_retries.inc(endpoint=retry.endpoint, reason='eresult')
+                self._sleep(fail_wait, 'retry')
 
         return json
 
+    @tracing.traced('potential_planets')
     def potential_planets(self):
         # GetPlanets only returns basic information about each planet.  We must
         # call GetPlanet to get the zones for the planet.
         planets_simple = self._call_api(self.api.get_planets)
-        planets = []
+        now = self.clock.monotonic()
+        planet_ids = []
+        summaries = {}
         for planet in planets_simple:
             # I'm not sure this is neccessary.  There might be a small chance
             # that a planet is captured and still active.
             if planet.get('state').get('captured'):
                 continue
-
             planet_id = planet.get('id')
-            planet_detail = self._call_api(self.api.get_planet, planet_id)
-            planets.append(Planet.from_json(planet_detail))
-        return planets
+            planet_ids.append(planet_id)
+            summaries[planet_id] = self._planet_summary(planet)
+
+        for planet_id in list(self._known_planets):
+            if planet_id not in summaries:
+                del self._known_planets[planet_id]
+
+        if len(planet_ids) == 0:
+            return []
+
+        changed = []
+        for planet_id in planet_ids:
+            known = self._known_planets.get(planet_id)
+            if known is None or known[0] != summaries[planet_id] or now - known[2] > self.planet_max_age:
+                changed.append(planet_id)
+        metrics.bot_planet_details.inc(len(changed), account=self.account_id, source='fetched')
+        metrics.bot_planet_details.inc(len(planet_ids) - len(changed), account=self.account_id, source='reused')
+
+        # The details are fetched in parallel.  map() re-raises the first
+        # failure, just like fetching them one at a time would.  Each fetch
+        # runs in a copy of our context so log records still know which
+        # account they are for.
+        if len(changed) > 0:
+            ctx = contextvars.copy_context()
+
+            def fetch(planet_id):
+                return ctx.copy().run(self._fetch_planet, planet_id, summaries[planet_id])
+
+            if self.planet_pool is not None:
+                list(self.planet_pool.map(fetch, changed))
+            else:
+                workers = min(self.planet_workers, len(changed))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(fetch, changed))
+        return [self._known_planets[planet_id][1] for planet_id in planet_ids]
+
+    @staticmethod
+    def _planet_summary(planet_json):
+        state = planet_json.get('state')
+        return (state.get('active'), state.get('captured'), state.get('capture_progress'),
+                state.get('current_players'), state.get('boss_zone_position'))
+
+    @tracing.traced('fetch planet')
+    def _fetch_planet(self, planet_id, summary=None):
+        planet_detail = self._call_api(self.api.get_planet, planet_id)
+        known = self._known_planets.get(planet_id)
+        if known is None:
+            planet = Planet.from_json(planet_detail)
+        else:
+            planet = known[1]
+            planet.update_from_json(planet_detail)
+            if summary is None:
+                summary = known[0]
+        self._known_planets[planet_id] = (summary, planet, self.clock.monotonic())
+        return planet
 
     @staticmethod
     def best_planet(planets):
         # Choose the planet with the most boss, high, medium, and low zones in
-        # that order of priority.
-        planets.sort(key=lambda p: len(p.zones(ZONE_LOW)), reverse=True)
-        planets.sort(key=lambda p: len(p.zones(ZONE_MEDIUM)), reverse=True)
-        planets.sort(key=lambda p: len(p.zones(ZONE_HIGH)), reverse=True)
-        planets.sort(key=lambda p: len(p.zones(ZONE_BOSS)), reverse=True)
+        # that order of priority.  The sort is stable, so among equals the
+        # first one listed wins.
+        planets.sort(key=lambda p: tuple(len(p.zones(d)) for d in ZONE_PRIORITY), reverse=True)
 
         best_planet = planets[0]
         return best_planet
 
     def play_zone(self):
+        # Returns False if we left the round early for a boss.
         score = self.zone.score()
-        report_damage_wait = 110 - self.player.time_in_zone
-        self.logger.debug(f'Waiting {report_damage_wait} seconds to report a score of {score}')
-        time.sleep(report_damage_wait)
-        resp = self._call_api(self.api.report_score, score)
-        display.zone_finished(resp)
-
-    def play_boss_zone(self):
-        display.message('Starting boss battle!')
-        use_heal = 0
-        damage_to_boss = 0
-        damage_taken = 0
-
-        report_damage_wait = 5
-        healing_cooldown = timedelta(seconds=120)
-        next_heal = datetime.now()
 
+        # Work out where to go next while we wait, so the only thing left
+        # after reporting is joining it.
+        ctx = contextvars.copy_context()
+        prefetch = self._prefetcher.submit(ctx.run, self.choose_target)
+
+        # Refresh the prefetched target a little before the report is due.
+        # The refresh runs on the prefetcher too, and is only waited for until
+        # the report is due.  If it isn't done by then it is picked up after
+        # reporting.
+        refresh_lead = 2 * self.api.rtt.estimate() + 1
+        self.logger.debug(f'Waiting {self.scheduler.wait_time():.2f} seconds to report a score of {score}')
+        boss = self._wait_in_zone(refresh_lead)
+        if boss is not None:
+            self._leave_for_boss(boss, prefetch)
+            return False
+        ctx = contextvars.copy_context()
+        refresh = self._prefetcher.submit(ctx.run, self._refresh_target, prefetch)
+        try:
+            target = refresh.result(timeout=self.scheduler.wait_time())
+        # Not the builtin TimeoutError, which it only is from Python 3.11.
+        except FutureTimeoutError:
+            self.logger.debug('Next target not ready in time, reporting without it')
+            self._pending_target = refresh
+            target = None
+        boss = self._wait_in_zone()
+        if boss is not None:
+            self._leave_for_boss(boss, prefetch, refresh)
+            return False
+
+        self._reported_at = self.clock.monotonic()
+        resp = self._report_score(score)
+        if resp is None:
+            display.message(f'Zone {self.zone.id} was captured before the round was over')
+            metrics.bot_wasted_rounds.inc(account=self.account_id)
+            self.player.left_zone()
+            self._next_target = target
+            return True
+        display.zone_finished(resp)
+        self._record_xp(int(resp.get('new_score', 0)) - int(resp.get('old_score', 0)))
+        self.player.reported_score(resp)
+        self._next_target = target
+        return True
+
+    def _wait_in_zone(self, lead=0):
+        # Sleeps until lead seconds before the score is due.  Returns the
+        # boss's (planet, zone) if one spawned and we should go for it.
         while True:
-            self.logger.debug(f'Reporting damage_to_boss {damage_to_boss} - use_heal {use_heal} - damage_taken {damage_taken}')
-            resp = self._call_api(self.api.report_boss_damage, use_heal, damage_to_boss, damage_taken)
-
-            if use_heal == 1:
-                use_heal = 0
-                next_heal = datetime.now() + healing_cooldown
-
-            waiting_for_players = resp.get('waiting_for_players')
-            if waiting_for_players:
-                self.logger.debug(f'Waiting for players, sleeping for {report_damage_wait} seconds...')
-                time.sleep(report_damage_wait)
+            wait = self.scheduler.wait_time() - lead
+            if not self._sleep(wait, 'round', self._boss_alert):
+                return None
+            self._boss_alert.clear()
+            boss = self.boss_watcher.current()
+            if boss is None or boss[1].game_id == self._last_boss_game:
                 continue
-
-            boss_status = resp.get('boss_status', None)
-            if boss_status is None:
-                self.logger.debug(f'Boss status empty, sleeping for {report_damage_wait} seconds...')
-                time.sleep(report_damage_wait)
+            done = self.scheduler.round_done()
+            if done < self.boss_preempt:
+                return boss
+            self.logger.debug(f'Boss spawned on Planet {boss[0].id}, finishing the round first ({done*100:.0f}% done)')
+
+    def _leave_for_boss(self, boss, *pending):
+        # pending are the futures still working out the target after this
+        # round, in the order they were submitted.  They are cancelled, or
+        # waited for if they already started, so they can't assign us a zone
+        # or update our planets while we are in the boss fight.
+        planet, zone = boss
+        display.message(f'Boss spawned on Planet {planet.id}! Leaving Zone {self.zone.id} for it...')
+        for future in reversed(pending):
+            if future.cancel():
                 continue
-
-            # Boss is ready to fight.  Start doing damage.
-            damage_to_boss = 1
-
-            display.boss_progress(resp, self.account_id)
-
-            should_heal = False
-            team = boss_status.get('boss_players')
-            total_hp_percent = 0.0
-            for player in team:
-                hp = player.get('hp')
-                max_hp = player.get('max_hp')
-                total_hp_percent += hp / max_hp
-
-                if player.get('accountid') == self.account_id:
-                    if hp <= 0:
-                        display.message('!!! Game Over. You are dead! :( !!!')
-                        return
-
-                # Checking if should_heal is false prevents it from being
-                # disabled again if a player before the last in the list needs
-                # healing.
-                if not should_heal:
-                    should_heal = max_hp - hp > 10000
-
-            avg_hp_percent = total_hp_percent / len(team)
-            remaining_cooldown = next_heal - datetime.now()
-            # Need to check if the remaining cooldown is less than 0 seconds,
-            # otherwise it will show something like 86000 seconds remaining.
-            if remaining_cooldown < timedelta(0):
-                seconds = 0
-            else:
-                seconds = remaining_cooldown.seconds
-            display.message(f'Average player health: {avg_hp_percent*100:.2f}% - Heal cooldown: {seconds} seconds')
-
-            if should_heal and next_heal <= datetime.now() + timedelta(seconds=report_damage_wait):
-                use_heal = 1
-                display.message('>>> Using Heal <<<')
-
-            if resp.get('game_over', False):
-                display.message('Game Over! Leaving boss game...')
+            try:
+                future.result()
+            except Exception:
+                self.logger.debug('Next target failed while leaving for a boss', exc_info=True)
+        self._pending_target = None
+        self._call_api(self.api.leave_game, self.zone.game_id)
+        self.player.left_zone()
+        # The boss is where we will be, not whatever the prefetch picked.
+        if self.assigner is not None:
+            self.assigner.claim(self.account_id, planet.id, zone.id)
+        self._next_target = boss
+
+    @tracing.traced('report')
+    def _report_score(self, score):
+        # Being a little early is expected now and then, so try again as soon
+        # as it could work instead of going through the normal backoff.
+        # Returns None if the zone was captured before we could report.
+        for _ in range(5):
+            json, eresult = self.api.report_score(score)
+            if eresult == '1':
+                self.scheduler.reported()
+                return json
+            if eresult == ERESULT_EXPIRED:
+                self._reconcile = True
+                return None
+            if eresult != ERESULT_TIME_NOT_SYNCED:
                 break
+            retry_wait = self.scheduler.reported_early()
+            self.logger.debug(f'Reported score too early, retrying in {retry_wait:.2f} seconds...')
+            self._sleep(retry_wait, 'early_report')
+        return self._call_api(self.api.report_score, score)
+
+    def _refresh_target(self, prefetch):
+        # The prefetched target could be almost two minutes old, so fetch its
+        # planet again and pick the zone from that.  Any failure just means
+        # the next round goes the slow way.
+        try:
+            target = prefetch.result()
+            if target is None:
+                return None
+            planet, _ = target
+            planet = self._fetch_planet(planet.id)
+            self.galaxy.apply(planet)
+            if self.assigner is not None:
+                target = self.assigner.assign(self.account_id, planet.id, self.scheduler.horizon())
+                zone = None if target is None else target[1]
+            else:
+                zone = self.galaxy.best_zone(planet.id, self.scheduler.horizon())
+        except CircuitOpenError:
+            raise
+        except Exception:
+            self.logger.debug('Unable to prefetch the next target', exc_info=True)
+            return None
+        if zone is None:
+            return None
+        return planet, zone
 
-            time.sleep(report_damage_wait)
+    def play_boss_zone(self):
+        display.message('Starting boss battle!')
+        pacer = BossPacer(self.clock)
+        if self._resumed_heal is not None:
+            pacer.healed(self._resumed_heal)
+            self._resumed_heal = None
+
+        game_id = self.zone.game_id
+        self._last_boss_game = game_id
+        if self.heals is not None:
+            self.heals.join(game_id, self.account_id)
+        metrics.bot_boss_fights.set(1, account=self.account_id)
+        try:
+            self._play_boss_game(game_id, pacer)
+        finally:
+            metrics.bot_boss_fights.set(0, account=self.account_id)
+            if self.heals is not None:
+                self.heals.leave(game_id, self.account_id)
 
         # Wait a bit before leaving.  Some times we check the planets again too
         # fast and try to join a boss room that is closed and we crash.
-        time.sleep(5)
+        self._sleep(5, 'boss')
+
+    def _play_boss_game(self, game_id, pacer):
+        use_heal = 0
+        damage_to_boss = 0
+        damage_taken = 0
+
+        while True:
+            with tracing.span('boss tick'):
+                self.logger.debug(f'Reporting damage_to_boss {damage_to_boss} - use_heal {use_heal} - damage_taken {damage_taken}')
+                pacer.sending()
+                resp = self._call_api(self.api.report_boss_damage, use_heal, damage_to_boss, damage_taken)
+
+                if use_heal == 1:
+                    use_heal = 0
+                    pacer.healed()
+                    self._save_checkpoint(last_heal=self.clock.time())
+
+                waiting_for_players = resp.get('waiting_for_players')
+                if waiting_for_players:
+                    report_damage_wait = pacer.waiting()
+                    self.logger.debug(f'Waiting for players, sleeping for {report_damage_wait:.1f} seconds...')
+                    self._sleep(report_damage_wait, 'boss')
+                    continue
+
+                boss_status = resp.get('boss_status', None)
+                if boss_status is None:
+                    report_damage_wait = pacer.waiting()
+                    self.logger.debug(f'Boss status empty, sleeping for {report_damage_wait:.1f} seconds...')
+                    self._sleep(report_damage_wait, 'boss')
+                    continue
+
+                # Boss is ready to fight.  Start doing damage.
+                damage_to_boss = 1
+                pacer.fighting()
+                if self.heals is not None:
+                    self.heals.observe(game_id, boss_status.get('boss_players'))
+
+                display.boss_progress(resp, self.account_id, self.clock)
+
+                should_heal = False
+                me = None
+                team = boss_status.get('boss_players')
+                total_hp_percent = 0.0
+                for player in team:
+                    hp = player.get('hp')
+                    max_hp = player.get('max_hp')
+                    total_hp_percent += hp / max_hp
+
+                    if player.get('accountid') == self.account_id:
+                        me = player
+                        if hp <= 0:
+                            display.message('!!! Game Over. You are dead! :( !!!')
+                            return
+
+                    # Checking if should_heal is false prevents it from being
+                    # disabled again if a player before the last in the list needs
+                    # healing.
+                    if not should_heal:
+                        should_heal = max_hp - hp > 10000
+
+                avg_hp_percent = total_hp_percent / len(team)
+                boss_hp_percent = boss_status.get('boss_hp', 0) / max(1, boss_status.get('boss_max_hp', 1))
+                report_damage_wait = pacer.next_delay(boss_hp_percent, avg_hp_percent)
+
+                seconds = int(pacer.heal_cooldown_left(me))
+                display.message(f'Average player health: {avg_hp_percent*100:.2f}% - Heal cooldown: {seconds} seconds')
+
+                # Ask for the heal on the report that will land after the
+                # cooldown is over.
+                if should_heal and seconds <= report_damage_wait:
+                    if self.heals is None or self.heals.claim(game_id, self.account_id, self.clock.time()):
+                        use_heal = 1
+                        display.message('>>> Using Heal <<<')
+                        metrics.bot_heals.inc(account=self.account_id, outcome='used')
+                    else:
+                        self.logger.debug(f'Leaving the heal to another of our accounts, next slot in {self.heals.spacing(game_id):.0f} seconds')
+                        metrics.bot_heals.inc(account=self.account_id, outcome='deferred')
+
+                if resp.get('game_over', False):
+                    display.message('Game Over! Leaving boss game...')
+                    return
+
+                self.logger.debug(f'Next boss report in {report_damage_wait:.1f} seconds')
+                self._sleep(report_damage_wait, 'boss')
+
+
+def _intern(value):
+    # Game ids and names are repeated in every response for every account, so
+    # keep one copy of each.
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
 
 
 class Planet():
+    # Slots keep the per-object overhead down, which adds up with a Planet,
+    # 96 Zones and a Player for every account.
+    __slots__ = ('id', 'active', 'captured', 'progress', 'name', 'current_players', 'boss_position',
+                 'signature', '_all_zones', '_zones')
+
     def __init__(self, planet_id, active, captured, progress, name, current_players, boss_position, zones):
         self.id = planet_id
         self.active = active
@@ -225,15 +725,18 @@ class Planet():
         self.name = name
         self.current_players = current_players
         self.boss_position = boss_position
+        # Every zone by position, captured or not, so updates can find them.
+        self._all_zones = {zone.id: zone for zone in zones}
         self._zones = self._group_zones(zones)
+        self.signature = self._signature(zones)
 
     @classmethod
     def from_json(cls, planet_json):
-        planet_id = planet_json.get('id')
+        planet_id = _intern(planet_json.get('id'))
         state = planet_json.get('state')
         active = state.get('active')
         captured = state.get('captured')
-        name = state.get('name')
+        name = _intern(state.get('name'))
         current_players = int(state.get('current_players', 0))
         boss_position = state.get('boss_zone_position', -1)
 
@@ -249,6 +752,38 @@ class Planet():
         planet = cls(planet_id, active, captured, progress, name, current_players, boss_position, zones)
         return planet
 
+    def update_from_json(self, planet_json):
+        # Updates the planet and its zones in place from a newer GetPlanet
+        # response for the same planet.
+        state = planet_json.get('state')
+        self.active = state.get('active')
+        self.captured = state.get('captured')
+        self.name = _intern(state.get('name'))
+        self.current_players = int(state.get('current_players', 0))
+        self.boss_position = state.get('boss_zone_position', -1)
+
+        zones = []
+        total_progress = 0
+        for zone_json in planet_json.get('zones'):
+            zone = self._all_zones.get(zone_json.get('zone_position'))
+            if zone is None:
+                zone = Zone.from_json(zone_json)
+                self._all_zones[zone.id] = zone
+            else:
+                zone.update_from_json(zone_json)
+            total_progress += zone.progress
+            zones.append(zone)
+        self.progress = total_progress / len(zones)
+        self._zones = self._group_zones(zones)
+        self.signature = self._signature(zones)
+
+    @staticmethod
+    def _signature(zones):
+        # Equal for planets with the same zones, even when they were parsed
+        # by different bots, so GalaxyIndex can tell it has seen them.
+        return hash(tuple((zone.id, zone.game_id, zone.type, zone.difficulty, zone.captured, zone.progress,
+                           zone.boss_active) for zone in zones))
+
     @staticmethod
     def _group_zones(zones):
         grouped = {
@@ -268,12 +803,16 @@ class Planet():
     def zones(self, difficulty):
         return self._zones[difficulty]
 
+    def zone(self, zone_id):
+        # Any zone by position, captured or not.
+        return self._all_zones.get(zone_id)
+
     def boss_active(self):
         return self.boss_position > -1
 
     def best_zone(self):
         # Choose the highest difficulty zone with the least progress captured.
-        for difficulty in [ZONE_BOSS, ZONE_HIGH, ZONE_MEDIUM, ZONE_LOW]:
+        for difficulty in ZONE_PRIORITY:
             zones = self.zones(difficulty)
             if len(zones) == 0:
                 continue
@@ -292,6 +831,8 @@ class Planet():
 
 
 class Zone():
+    __slots__ = ('id', 'game_id', 'type', 'difficulty', 'captured', 'progress', 'boss_active')
+
     _SCORES = {
         ZONE_LOW: 600,
         ZONE_MEDIUM: 1200,
@@ -316,7 +857,7 @@ class Zone():
     @classmethod
     def from_json(cls, zone_json):
         zone_id = zone_json.get('zone_position')
-        game_id = zone_json.get('gameid')
+        game_id = _intern(zone_json.get('gameid'))
         zone_type = zone_json.get('type')
         difficulty = zone_json.get('difficulty')
         captured = zone_json.get('captured')
@@ -327,14 +868,29 @@ class Zone():
                    captured, progress, boss_active)
         return zone
 
+    def update_from_json(self, zone_json):
+        self.game_id = _intern(zone_json.get('gameid'))
+        self.type = zone_json.get('type')
+        self.difficulty = zone_json.get('difficulty')
+        self.captured = zone_json.get('captured')
+        self.progress = zone_json.get('capture_progress', 0)
+        self.boss_active = zone_json.get('boss_active', False)
+
     def score(self):
-        return self._SCORES.get(self.difficulty, -1)
+        return self.difficulty_score(self.difficulty)
+
+    @classmethod
+    def difficulty_score(cls, difficulty):
+        return cls._SCORES.get(difficulty, -1)
 
     def difficulty_name(self):
         return self._DIFFICULTY_NAMES.get(self.difficulty, -1)
 
 
 class Player():
+    __slots__ = ('level', 'score', 'next_level_score', 'active_planet', 'time_on_planet', 'active_zone',
+                 'active_zone_game', 'time_in_zone')
+
     def __init__(self, level, score, next_level_score, active_planet, time_on_planet, active_zone, active_zone_game, time_in_zone):
         self.level = level
         self.score = score
@@ -363,3 +919,37 @@ class Player():
 
         player = cls(level, score, next_level_score, active_planet, time_on_planet, active_zone, active_zone_game, time_in_zone)
         return player
+
+    # The methods below keep the player in step with the server from the
+    # responses to our own calls, without asking GetPlayerInfo.
+
+    def joined_planet(self, planet_id):
+        self.active_planet = planet_id
+        self.time_on_planet = 0
+        self.left_zone()
+
+    def left_planet(self):
+        self.active_planet = None
+        self.time_on_planet = 0
+        self.left_zone()
+
+    def joined_zone(self, zone):
+        self.active_zone = zone.id
+        self.active_zone_game = zone.game_id
+        self.time_in_zone = 0
+
+    def left_zone(self):
+        self.active_zone = None
+        self.active_zone_game = None
+        self.time_in_zone = 0
+
+    def reported_score(self, score_json):
+        # Reporting the score ends the round and takes us out of the zone.
+        self.score = int(score_json.get('new_score', self.score))
+        self.level = score_json.get('new_level', self.level)
+        next_level_score = score_json.get('next_level_score')
+        if next_level_score is not None:
+            self.next_level_score = int(next_level_score)
+        else:
+            self.next_level_score = max(self.next_level_score, self.score)
+        self.left_zone()
@@ -0,0 +1,125 @@
+import logging
+import threading
+
+from clock import Clock
+
+
+class _Entry():
+    def __init__(self, value, expires):
+        self.value = value
+        self.expires = expires
+
+
+class _Flight():
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class GalaxyCache():
+    # Caches GetPlanets and GetPlanet responses so several accounts can share
+    # one view of the galaxy.  Only successful responses are cached; anything
+    # with a bad eresult is handed back to the caller untouched.
+    _PLANETS_KEY = ('planets',)
+
+    def __init__(self, ttl=10, clock=None):
+        self.ttl = ttl
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        # Misses that waited on someone else's request instead of sending one.
+        self.coalesced = 0
+
+        self._entries = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(__name__)
+
+    def get_planets(self, fetch, active_only=1):
+        key = self._PLANETS_KEY + (active_only,)
+        return self._get(key, fetch, active_only)
+
+    def get_planet(self, fetch, planet_id):
+        key = ('planet', planet_id)
+        return self._get(key, fetch, planet_id)
+
+    def invalidate_planet(self, planet_id):
+        # Only the planet's detail.  The summaries in GetPlanets only carry
+        # the planet's overall progress, which the TTL keeps close enough,
+        # and dropping them on every change would leave a fleet with
+        # hardly any hits.
+        with self._lock:
+            self._entries.pop(('planet', planet_id), None)
+
+    def update_zone(self, planet_id, zone_json):
+        # Drops the planet's detail if it disagrees with zone_json, a zone
+        # from a fresher response such as JoinZone's zone_info.
+        if zone_json is None:
+            return
+        with self._lock:
+            entry = self._entries.get(('planet', planet_id))
+            if entry is None:
+                return
+            for cached in entry.value[0].get('zones', []):
+                if cached.get('zone_position') != zone_json.get('zone_position'):
+                    continue
+                if (cached.get('captured') != zone_json.get('captured')
+                        or cached.get('capture_progress') != zone_json.get('capture_progress')):
+                    del self._entries[('planet', planet_id)]
+                return
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'entries': len(self._entries),
+            }
+
+    def _get(self, key, fetch, *args):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > self.clock.monotonic():
+                self.hits += 1
+                return entry.value
+
+            self.misses += 1
+            # Only one request per key goes out at a time.  Everyone else that
+            # asks for the same thing waits for that request to finish.
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = fetch(*args)
+            flight.value = value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.value is not None and flight.value[1] == '1':
+                    self._entries[key] = _Entry(flight.value, self.clock.monotonic() + self.ttl)
+            flight.done.set()
+
+        return value
@@ -0,0 +1,53 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint():
+    # A small JSON file where a bot keeps the round it is in, so a restarted
+    # bot can carry on with it instead of leaving the zone and starting over.
+    # Nothing in it is secret; the token is never saved.
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        # Returns the saved state, or None if there is none we can read.
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.debug(f'Unable to read checkpoint {self.path}', exc_info=True)
+            return None
+
+    def save(self, state):
+        # Written to a temporary file and renamed, so a crash while writing
+        # leaves the previous checkpoint.  Failing to save only costs us the
+        # resume, so it isn't worth stopping the bot for.
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            logger.debug(f'Unable to write checkpoint {self.path}', exc_info=True)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.debug(f'Unable to remove checkpoint {self.path}', exc_info=True)
+
+
+def for_account(directory, account_id):
+    # Returns the checkpoint for an account, or None if directory is None or
+    # empty, which turns checkpoints off.
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return Checkpoint(os.path.join(directory, f'{account_id}.json'))
@@ -0,0 +1,83 @@
+import threading
+import time
+from datetime import datetime
+
+
+class SimulationFinished(Exception):
+    pass
+
+
+class Clock():
+    # Everything that sleeps or looks at the time goes through a clock, so a
+    # SimulatedClock can be swapped in to run rounds faster than real time.
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, event, seconds):
+        # Sleeps like sleep() but returns early, with True, if event is set.
+        if seconds <= 0:
+            return event.is_set()
+        return event.wait(seconds)
+
+
+class SimulatedClock(Clock):
+    # Time only moves when someone sleeps, and a sleep returns immediately
+    # after moving it forward.  This is meant for replaying one timeline at a
+    # time: if several threads sleep on the same clock their sleeps add up
+    # instead of overlapping.
+    def __init__(self, start=None, duration=None):
+        if start is None:
+            start = time.time()
+        self._start = start
+        self._elapsed = 0.0
+        # Once this many simulated seconds have passed, sleep() raises
+        # SimulationFinished so the bot loop stops.
+        self.duration = duration
+        self._lock = threading.Lock()
+
+    def time(self):
+        with self._lock:
+            return self._start + self._elapsed
+
+    def monotonic(self):
+        with self._lock:
+            return self._elapsed
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    def elapsed(self):
+        return self.monotonic()
+
+    def sleep(self, seconds):
+        with self._lock:
+            if seconds > 0:
+                self._elapsed += seconds
+            finished = self.duration is not None and self._elapsed >= self.duration
+        if finished:
+            raise SimulationFinished()
+
+    def wait(self, event, seconds):
+        # Nothing else runs while simulated time passes, so the event can only
+        # have been set before the wait or by the time it is over.
+        if event.is_set():
+            return True
+        self.sleep(seconds)
+        return event.is_set()
+
+    def advance(self, seconds):
+        # Moves time forward without ever ending the simulation, for things
+        # like simulated request latency.
+        with self._lock:
+            self._elapsed += seconds
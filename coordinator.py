@@ -0,0 +1,229 @@
+import logging
+import threading
+
+from bot import ZONE_BOSS, Planet, Zone
+
+logger = logging.getLogger(__name__)
+
+
+class HealCoordinator():
+    # Shared by the bots of a fleet so our accounts in the same boss game take
+    # turns healing.  A heal helps the whole team and then goes on cooldown,
+    # so two of our accounts healing together wastes one of them.  With n of
+    # our accounts in a game, heals are spread out to one every cooldown / n
+    # seconds.
+    def __init__(self, heal_cooldown=120):
+        self.heal_cooldown = heal_cooldown
+        # game id -> {'members': set of account ids, 'last_heal': time}
+        self._games = {}
+        self._lock = threading.Lock()
+
+    def join(self, game_id, account_id):
+        with self._lock:
+            game = self._games.setdefault(game_id, {'members': set(), 'last_heal': None})
+            game['members'].add(account_id)
+
+    def leave(self, game_id, account_id):
+        with self._lock:
+            game = self._games.get(game_id)
+            if game is None:
+                return
+            game['members'].discard(account_id)
+            if len(game['members']) == 0:
+                del self._games[game_id]
+
+    def observe(self, game_id, boss_players):
+        # Picks up heals our accounts made that we didn't hand out, such as
+        # ones from before a restart, from the boss_status player list.
+        with self._lock:
+            game = self._games.get(game_id)
+            if game is None:
+                return
+            for player in boss_players:
+                if player.get('accountid') not in game['members']:
+                    continue
+                last_heal = player.get('time_last_heal')
+                if last_heal and (game['last_heal'] is None or last_heal > game['last_heal']):
+                    game['last_heal'] = last_heal
+
+    def spacing(self, game_id):
+        with self._lock:
+            game = self._games.get(game_id)
+            members = 1 if game is None else max(1, len(game['members']))
+            return self.heal_cooldown / members
+
+    def claim(self, game_id, account_id, now):
+        # Returns whether account_id should heal now.  The caller is expected
+        # to have checked its own cooldown already.
+        with self._lock:
+            game = self._games.setdefault(game_id, {'members': {account_id}, 'last_heal': None})
+            spacing = self.heal_cooldown / max(1, len(game['members']))
+            last_heal = game['last_heal']
+            if last_heal is not None and now - last_heal < spacing:
+                return False
+            game['last_heal'] = now
+            return True
+
+
+class ZoneAssigner():
+    # Picks targets for the bots of a fleet.  Left to themselves every bot
+    # makes the same greedy choice, piles into the same zone, finishes it at
+    # the same time as the others and then stampedes to the next one.  The
+    # assigner knows where each of our accounts is and values a zone by the
+    # XP one more account there can expect: its score while it lasts, cut
+    # down when our own accounts would capture it before the round is out.
+    #
+    # account_progress is how much of a zone one of our accounts captures in
+    # a round.  Boss zones are always worth joining together.
+    def __init__(self, galaxy, account_progress=0.01):
+        self.galaxy = galaxy
+        self.account_progress = account_progress
+        # account id -> (planet id, zone id)
+        self._assignments = {}
+        self._lock = threading.Lock()
+
+    def assign(self, account_id, planet_id=None, horizon=None):
+        # Returns the (planet, zone) account_id should play next, or None if
+        # there is nothing to play.  planet_id limits the choice to one
+        # planet, and zones the galaxy expects to be captured within horizon
+        # seconds are worth nothing.
+        with self._lock:
+            self._assignments.pop(account_id, None)
+            crowd = {}
+            for target in self._assignments.values():
+                crowd[target] = crowd.get(target, 0) + 1
+
+            if planet_id is None:
+                planets = self.galaxy.planets()
+            else:
+                planet = self.galaxy.planet(planet_id)
+                planets = [] if planet is None else [planet]
+
+            # Zones are taken a difficulty at a time, best first, and a planet
+            # at a time in the galaxy's order.  Nothing in a difficulty can
+            # be worth more than its score, so the search stops as soon as
+            # what we have can't be beaten.
+            best = None
+            best_key = None
+            for difficulty in self.galaxy.priority:
+                most = float('inf') if difficulty == ZONE_BOSS else Zone.difficulty_score(difficulty)
+                if best_key is not None and best_key[0] > most:
+                    break
+                for rank, planet in enumerate(planets):
+                    for zone in planet.zones(difficulty):
+                        ours = crowd.get((planet.id, zone.id), 0)
+                        # Ties go to the zone with fewer of our accounts, then
+                        # the better planet, then the least progress.
+                        key = (self.value(zone, ours), -ours, -rank, -zone.progress)
+                        if best_key is not None and key <= best_key:
+                            continue
+                        if horizon is not None and self.galaxy.closes_in(planet.id, zone.id) <= horizon:
+                            key = (0,) + key[1:]
+                            if best_key is not None and key <= best_key:
+                                continue
+                        best = (planet, zone)
+                        best_key = key
+                    # Later planets can only tie on value and lose on rank.
+                    if best_key is not None and best_key[:2] == (most, 0):
+                        break
+
+            if best is not None:
+                self._assignments[account_id] = (best[0].id, best[1].id)
+            return best
+
+    def claim(self, account_id, planet_id, zone_id):
+        # Records a zone account_id is already in, such as one it was in
+        # before a restart.
+        with self._lock:
+            self._assignments[account_id] = (planet_id, zone_id)
+
+    def release(self, account_id):
+        with self._lock:
+            self._assignments.pop(account_id, None)
+
+    def value(self, zone, ours):
+        # Expected XP per round for another account joining a zone that ours
+        # of our accounts are already in.
+        if zone.boss_active:
+            return float('inf')
+        rounds_left = (1 - zone.progress) / (self.account_progress * (ours + 1))
+        return zone.score() * min(1, rounds_left)
+
+
+class BossWatcher():
+    # Polls GetPlanets in the background for boss spawns and wakes the bots
+    # waiting on it, so they can leave a regular round for the boss.  With a
+    # shared cache GetPlanets is usually a cache hit, and GetPlanet is only
+    # asked for planets that have a boss.
+    def __init__(self, client, interval=15):
+        self.client = client
+        self.interval = interval
+        # The (planet, zone) of the boss we know about, if any.
+        self._boss = None
+        self._events = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='boss-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def subscribe(self):
+        # Returns an event that is set whenever a new boss shows up.  Clear it
+        # after looking at current().
+        event = threading.Event()
+        with self._lock:
+            self._events.add(event)
+            if self._boss is not None:
+                event.set()
+        return event
+
+    def unsubscribe(self, event):
+        with self._lock:
+            self._events.discard(event)
+
+    def current(self):
+        with self._lock:
+            return self._boss
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception:
+                logger.debug('Unable to check for bosses', exc_info=True)
+            self._stop.wait(self.interval)
+
+    def check(self):
+        planets, eresult = self.client.get_planets()
+        if eresult != '1':
+            return
+        boss = None
+        for planet_json in planets:
+            state = planet_json.get('state')
+            if state.get('captured') or state.get('boss_zone_position') is None:
+                continue
+            detail, eresult = self.client.get_planet(planet_json.get('id'))
+            if eresult != '1':
+                continue
+            planet = Planet.from_json(detail)
+            zones = [zone for zone in planet.zones(ZONE_BOSS) if zone.boss_active]
+            if len(zones) > 0:
+                boss = (planet, zones[0])
+                break
+
+        with self._lock:
+            previous = self._boss
+            self._boss = boss
+            if boss is None or (previous is not None and previous[1].game_id == boss[1].game_id):
+                return
+            events = list(self._events)
+        logger.debug(f'Boss found on Planet {boss[0].id} Zone {boss[1].id}')
+        for event in events:
+            event.set()
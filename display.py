@@ -1,7 +1,7 @@
 import logging
-import time
 from datetime import datetime, timedelta
 
+from clock import Clock
 from version import __version__ as version
 
 logger = logging.getLogger(__name__)
@@ -16,6 +16,8 @@ def message(msg):
 
 
 def player_info(player):
+    if not logger.isEnabledFor(logging.INFO):
+        return
     logger.info('--- Player Information ---')
     level = player.level
     score = player.score
@@ -34,6 +36,8 @@ def player_info(player):
 
 
 def planets(planets):
+    if not logger.isEnabledFor(logging.INFO):
+        return
     logger.info('--- Active Planets ---')
     logger.info('Planet  Progress  Boss  High  Medium  Low    Players  Name')
     for planet in planets:
@@ -66,7 +70,12 @@ def zone_finished(score_json):
     logger.info(msg)
 
 
-def boss_progress(data, account_id):
+def boss_progress(data, account_id, clock=None):
+    # Called on every boss tick, so don't build the table for nothing.
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    if clock is None:
+        clock = Clock()
     status = data.get('boss_status')
     players = status.get('boss_players')
 
@@ -84,7 +93,7 @@ def boss_progress(data, account_id):
         next_heal = last_heal + timedelta(seconds=120)
         # TODO: some duplicated logic here from Bot.play_boss_zone().  is it
         # worth refactoring?  probably not.
-        remaining_cooldown = next_heal - datetime.now()
+        remaining_cooldown = next_heal - clock.now()
         if remaining_cooldown < timedelta(0):
             seconds = 0
         else:
@@ -0,0 +1,233 @@
+import contextvars
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import checkpoint
+import metrics
+from api import _HOST, Client, new_session
+from bot import ZONE_PRIORITY, Bot
+from cache import GalaxyCache
+from coordinator import BossWatcher, HealCoordinator, ZoneAssigner
+from galaxy import GalaxyIndex
+from retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# The account a log record belongs to.  Each account's thread sets this
+# before starting its bot, and the bot copies the context into the threads it
+# starts, so every record logged on behalf of the account (including the ones
+# from display) can be tagged with it.
+current_account = contextvars.ContextVar('current_account', default='-')
+
+
+class AccountFilter(logging.Filter):
+    def filter(self, record):
+        record.account = current_account.get()
+        return True
+
+
+class SummaryFilter(logging.Filter):
+    # For the console in summary mode: drops the per-account lines below
+    # WARNING and keeps the fleet summaries.  Goes after AccountFilter.
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or getattr(record, 'account', '-') == '-'
+
+
+class FleetSummary():
+    # Logs one line for the whole fleet every interval seconds, for when a
+    # few lines per account per round would be too many to read.
+    # request_detail() logs a line per account as well, right away.
+    def __init__(self, names, interval=60):
+        # account id -> name
+        self.names = names
+        self.interval = interval
+        self._last = None
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._last = self._sample()
+        self._thread = threading.Thread(target=self._run, name='fleet-summary', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def request_detail(self):
+        # Safe to call from a signal handler.
+        self._wake.set()
+
+    def _run(self):
+        next_summary = time.monotonic() + self.interval
+        while True:
+            self._wake.wait(max(0, next_summary - time.monotonic()))
+            if self._stopped:
+                return
+            try:
+                if self._wake.is_set():
+                    self._wake.clear()
+                    self.detail()
+                if time.monotonic() >= next_summary:
+                    next_summary += self.interval
+                    self.summary()
+            except Exception:
+                logger.debug('Unable to log the fleet summary', exc_info=True)
+
+    def _sample(self):
+        # Attempts that failed outright never got an eresult, so they are
+        # counted on top of the responses, as requests and as errors.
+        responses = metrics.api_eresults.by('eresult')
+        failures = metrics.api_failures.total()
+        requests = sum(responses.values()) + failures
+        return (time.monotonic(), metrics.bot_rounds.total(), metrics.bot_xp.total(), requests,
+                requests - responses.get('1', 0), metrics.api_retries.total())
+
+    def summary(self):
+        sample = self._sample()
+        then, rounds, xp, requests, errors, retries = [now - last for now, last in zip(sample, self._last)]
+        self._last = sample
+        elapsed = max(1e-9, then)
+        in_boss = sum(1 for value in metrics.bot_boss_fights.by('account').values() if value > 0)
+        error_percent = errors / requests * 100 if requests > 0 else 0
+        logger.info(f'{len(self.names)} accounts - {rounds / elapsed * 60:.1f} rounds/min - '
+                    f'{xp / elapsed * 3600:,.0f} XP/hour - {in_boss} in boss fights - '
+                    f'{error_percent:.1f}% errors - {retries:.0f} retries')
+
+    def detail(self):
+        rounds = metrics.bot_rounds.by('account')
+        xp_per_hour = metrics.bot_xp_per_hour.by('account')
+        in_boss = metrics.bot_boss_fights.by('account')
+        restarts = metrics.bot_restarts.by('account')
+        for account_id, name in self.names.items():
+            where = 'boss fight' if in_boss.get(account_id, 0) > 0 else 'zone'
+            logger.info(f'{name:12} {rounds.get(account_id, 0):6,d} rounds - '
+                        f'{xp_per_hour.get(account_id, 0):10,.0f} XP/hour - in {where} - '
+                        f'{restarts.get(account_id, 0)} restarts')
+
+
+class Account():
+    def __init__(self, token, steamid64, name=None):
+        self.token = token
+        self.steamid64 = steamid64
+        self.steamid32 = steamid64 & 0xFFFFFFFF
+        if name is None:
+            name = str(self.steamid32)
+        self.name = name
+
+
+def load_accounts(path):
+    # One account per line: token steamid [name].  Blank lines and lines
+    # starting with # are ignored.
+    accounts = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) < 2:
+                raise ValueError(f'{path}:{line_number}: expected "token steamid [name]"')
+            token = fields[0]
+            steamid64 = int(fields[1])
+            name = fields[2] if len(fields) > 2 else None
+            accounts.append(Account(token, steamid64, name))
+    return accounts
+
+
+def run_account(account, session, cache, retry_policy, host, rate_limiter, checkpoint_dir=None, recorder=None,
+                restart_delay=10, max_restart_delay=600, **bot_options):
+    # Runs on the account's own thread until its bot has nothing left to do.
+    current_account.set(account.name)
+    client = Client(account.token, session=session, cache=cache, retry_policy=retry_policy, host=host,
+                    rate_limiter=rate_limiter, recorder=recorder)
+    # A restarted bot picks up the round the last one was in.
+    bot_options['checkpoint'] = checkpoint.for_account(checkpoint_dir, account.steamid32)
+    failures = 0
+    while True:
+        bot = Bot(client, account.steamid32, **bot_options)
+        started = time.monotonic()
+        try:
+            bot.run()
+            return
+        except Exception:
+            logger.exception(f'Account {account.name} stopped')
+        # Start the account again with a fresh bot, backing off if it keeps
+        # failing.  A bot that ran for a while before failing starts over.
+        if time.monotonic() - started > max_restart_delay:
+            failures = 0
+        delay = min(max_restart_delay, restart_delay * 2 ** failures)
+        failures += 1
+        metrics.bot_restarts.inc(account=account.steamid32)
+        logger.info(f'Restarting account {account.name} in {delay:.0f} seconds')
+        time.sleep(delay)
+
+
+def run_accounts(accounts, pool_size=None, cache_ttl=10, host=_HOST, boss_watch_interval=15,
+                 rate_limiter=None, summary_interval=None, checkpoint_dir=None, recorder=None, **bot_options):
+    # Blocks until every account is done.  Each account still gets its own
+    # thread, since Bot is blocking and spends most of its time asleep; what
+    # the accounts share is everything else.
+    if pool_size is None:
+        pool_size = max(10, len(accounts))
+    # Every account shares one session and connection pool, one cached and
+    # indexed view of the galaxy, one circuit breaker, one heal rota for boss
+    # fights and one assigner spreading them over the zones.
+    session = new_session(pool_size)
+    cache = GalaxyCache(ttl=cache_ttl)
+    retry_policy = RetryPolicy()
+    bot_options.setdefault('galaxy', GalaxyIndex(ZONE_PRIORITY))
+    bot_options.setdefault('heals', HealCoordinator())
+    bot_options.setdefault('assigner', ZoneAssigner(bot_options['galaxy']))
+    # Planet details are fetched on one pool for the whole fleet.  Each
+    # account still has its own thread and one more that picks its next
+    # target during a round.
+    planet_pool = ThreadPoolExecutor(max_workers=max(1, bot_options.get('planet_workers', 8)),
+                                     thread_name_prefix='planet')
+    bot_options.setdefault('planet_pool', planet_pool)
+    # One watcher looks out for bosses for every account.  GetPlanets doesn't
+    # need a token.
+    watcher = None
+    if bot_options.get('boss_preempt', 1) > 0 and 'boss_watcher' not in bot_options:
+        watcher_client = Client(None, session=session, cache=cache, retry_policy=retry_policy, host=host,
+                                rate_limiter=rate_limiter, recorder=recorder)
+        watcher = BossWatcher(watcher_client, boss_watch_interval)
+        watcher.start()
+        bot_options['boss_watcher'] = watcher
+    # In summary mode, kill -USR1 the process for a line per account.
+    summary = None
+    if summary_interval is not None:
+        summary = FleetSummary({str(account.steamid32): account.name for account in accounts}, summary_interval)
+        summary.start()
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: summary.request_detail())
+        except (AttributeError, ValueError):
+            logger.debug('Unable to handle SIGUSR1, per-account detail is off')
+
+    executor = ThreadPoolExecutor(max_workers=len(accounts), thread_name_prefix='account')
+    futures = [executor.submit(run_account, account, session, cache, retry_policy, host, rate_limiter,
+                               checkpoint_dir, recorder, **bot_options)
+               for account in accounts]
+    try:
+        # Waiting here rather than in shutdown() keeps Ctrl+C working.
+        for future in futures:
+            future.result()
+    finally:
+        # The bots never return by themselves, so don't wait for them.
+        executor.shutdown(wait=False)
+        planet_pool.shutdown(wait=False)
+        if watcher is not None:
+            watcher.stop()
+        if summary is not None:
+            summary.stop()
+        logger.debug(f'Galaxy cache: {cache.stats()}')
+
+
+def run(accounts, **options):
+    run_accounts(accounts, **options)
@@ -0,0 +1,296 @@
+import heapq
+import itertools
+import threading
+
+from clock import Clock
+
+
+class CaptureRate():
+    # Estimates how fast a zone is being captured with a least squares line
+    # through its last few capture_progress samples.  There is one of these
+    # for every zone, so it is kept small.
+    __slots__ = ('samples', 'window', 'min_interval')
+
+    def __init__(self, window=8, min_interval=30):
+        self.samples = []
+        self.window = window
+        # Unchanged progress is only sampled this often, so a zone that is
+        # polled a lot doesn't push its history out with copies.
+        self.min_interval = min_interval
+
+    def add(self, now, progress):
+        if len(self.samples) > 0:
+            last_time, last_progress = self.samples[-1]
+            if progress < last_progress:
+                # The zone was reset, so the history is for another game.
+                self.samples.clear()
+            elif progress == last_progress and now - last_time < self.min_interval:
+                return
+        self.samples.append((now, progress))
+        if len(self.samples) > self.window:
+            del self.samples[0]
+
+    def rate(self):
+        # Progress per second, or None without enough history.
+        if len(self.samples) < 2:
+            return None
+        n = len(self.samples)
+        mean_t = sum(t for t, _ in self.samples) / n
+        mean_p = sum(p for _, p in self.samples) / n
+        var_t = sum((t - mean_t) ** 2 for t, _ in self.samples)
+        if var_t == 0:
+            return None
+        cov = sum((t - mean_t) * (p - mean_p) for t, p in self.samples)
+        return cov / var_t
+
+    def closes_in(self, now):
+        # Seconds from now until the zone is expected to be captured, or
+        # infinity if it doesn't look like it is moving.
+        rate = self.rate()
+        if rate is None or rate <= 0:
+            return float('inf')
+        last_time, last_progress = self.samples[-1]
+        return (1 - last_progress) / rate - (now - last_time)
+
+
+class GalaxyIndex():
+    # Keeps the planets we know about ranked, so picking a planet or a zone
+    # doesn't mean sorting everything again each round.  New API responses are
+    # applied as diffs: planets whose zones look the same as last time are
+    # skipped without looking at each zone, and only zones whose progress or state changed
+    # are pushed onto the heaps.  Entries that are out of date are left where they are
+    # and skipped when they reach the top.
+    #
+    # priority is the list of zone difficulties from most to least wanted.
+    # Planets are ranked by how many uncaptured zones they have of each
+    # difficulty, in that order, and zones by the least capture progress.
+    def __init__(self, priority, clock=None):
+        self.priority = list(priority)
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+
+        self._planets = {}
+        self._order = {}
+        # planet id -> (zone counts, order, stamp) of its live heap entry
+        self._planet_entries = {}
+        self._planet_heap = []
+        # planet id -> zone id -> (zone, stamp, state it was ranked with).
+        # Planets and zones can be updated in place, so the state is kept to
+        # tell whether a zone changed since.
+        self._zones = {}
+        # planet id -> difficulty -> heap of (progress, zone id, stamp)
+        self._zone_heaps = {}
+        # planet id -> zone id -> CaptureRate
+        self._rates = {}
+        # planet id -> (signature its zones were last ranked from, monotonic
+        # time their capture rates were last sampled).  A planet with the
+        # same signature has the same zones, whichever bot parsed it, so there
+        # is nothing to diff.  Unchanged progress is still sampled now and
+        # then, so a zone that stalls stops looking like it is closing.
+        self._applied = {}
+        self.resample_interval = 30
+
+        self._stamps = itertools.count()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._planets)
+
+    def update(self, planets):
+        # Applies a full list of active planets, in GetPlanets order.  Planets
+        # missing from the list are dropped.
+        with self._lock:
+            seen = set()
+            for order, planet in enumerate(planets):
+                seen.add(planet.id)
+                self._order[planet.id] = order
+                self._apply(planet)
+            for planet_id in list(self._planets):
+                if planet_id not in seen:
+                    self.remove(planet_id)
+
+    def apply(self, planet):
+        # Applies a single fresh planet, such as one we just fetched again.
+        with self._lock:
+            if planet.id not in self._order:
+                self._order[planet.id] = len(self._order)
+            self._apply(planet)
+
+    def remove(self, planet_id):
+        with self._lock:
+            self._planets.pop(planet_id, None)
+            self._order.pop(planet_id, None)
+            self._planet_entries.pop(planet_id, None)
+            self._zones.pop(planet_id, None)
+            self._zone_heaps.pop(planet_id, None)
+            self._rates.pop(planet_id, None)
+            self._applied.pop(planet_id, None)
+
+    def planet(self, planet_id):
+        return self._planets.get(planet_id)
+
+    def planets(self):
+        # Every planet, best first.
+        with self._lock:
+            ranked = sorted(self._planet_entries.items(),
+                            key=lambda item: tuple(-count for count in item[1][0]) + (item[1][1],))
+            return [self._planets[planet_id] for planet_id, _ in ranked]
+
+    def zones(self, planet_id):
+        # The planet's uncaptured zones, in no particular order.
+        with self._lock:
+            return [entry[0] for entry in self._zones.get(planet_id, {}).values()]
+
+    def best_planet(self):
+        with self._lock:
+            heap = self._planet_heap
+            while len(heap) > 0:
+                entry = heap[0]
+                if self._planet_live(entry):
+                    return self._planets[entry[-2]]
+                heapq.heappop(heap)
+            return None
+
+    def best_zone(self, planet_id, horizon=None):
+        # With a horizon, zones expected to be captured within that many
+        # seconds are passed over, since a round there would be wasted.  If
+        # every zone is closing the best one is returned anyway.
+        with self._lock:
+            zones = self._zones.get(planet_id)
+            if zones is None:
+                return None
+            now = self.clock.monotonic()
+            heaps = self._zone_heaps[planet_id]
+            fallback = None
+            for difficulty in self.priority:
+                heap = heaps[difficulty]
+                while len(heap) > 0:
+                    _, zone_id, stamp = heap[0]
+                    current = zones.get(zone_id)
+                    if current is not None and current[1] == stamp:
+                        break
+                    heapq.heappop(heap)
+                if len(heap) == 0:
+                    continue
+                zone = zones[heap[0][1]][0]
+                if horizon is None or self._closes_in(planet_id, zone.id, now) > horizon:
+                    return zone
+                if fallback is None:
+                    fallback = zone
+                # Only when the top zone is closing do we look further down.
+                for _, zone_id, stamp in sorted(heap):
+                    current = zones.get(zone_id)
+                    if current is None or current[1] != stamp:
+                        continue
+                    if self._closes_in(planet_id, zone_id, now) > horizon:
+                        return current[0]
+            return fallback
+
+    def closes_in(self, planet_id, zone_id):
+        # Seconds until the zone is expected to be captured.
+        with self._lock:
+            return self._closes_in(planet_id, zone_id, self.clock.monotonic())
+
+    def _closes_in(self, planet_id, zone_id, now):
+        rate = self._rates.get(planet_id, {}).get(zone_id)
+        if rate is None:
+            return float('inf')
+        return rate.closes_in(now)
+
+    def _apply(self, planet):
+        order = self._order[planet.id]
+        now = self.clock.monotonic()
+        applied = self._applied.get(planet.id)
+        if applied is not None and applied[0] == planet.signature:
+            if now - applied[1] >= self.resample_interval:
+                self._sample_rates(planet.id, now)
+                self._applied[planet.id] = (planet.signature, now)
+            if self._planet_entries[planet.id][1] == order:
+                return
+        else:
+            self._apply_zones(planet, now)
+            self._applied[planet.id] = (planet.signature, now)
+
+        self._planets[planet.id] = planet
+        counts = tuple(len(planet.zones(difficulty)) for difficulty in self.priority)
+        previous = self._planet_entries.get(planet.id)
+        if previous is not None and previous[:2] == (counts, order):
+            return
+
+        stamp = next(self._stamps)
+        self._planet_entries[planet.id] = (counts, order, stamp)
+        # Most zones first, and among equals whichever GetPlanets listed
+        # first, which is the order the old stable sorts gave.
+        key = tuple(-count for count in counts) + (order, planet.id, stamp)
+        heapq.heappush(self._planet_heap, key)
+        if len(self._planet_heap) > 2 * len(self._planets) + 16:
+            live = [e for e in self._planet_heap if self._planet_live(e)]
+            heapq.heapify(live)
+            self._planet_heap = live
+
+    def _sample_rates(self, planet_id, now):
+        rates = self._rates[planet_id]
+        for zone, _, _ in self._zones[planet_id].values():
+            rates[zone.id].add(now, zone.progress)
+
+    def _apply_zones(self, planet, now):
+        zones = self._zones.setdefault(planet.id, {})
+        heaps = self._zone_heaps.get(planet.id)
+        if heaps is None:
+            heaps = {difficulty: [] for difficulty in self.priority}
+            self._zone_heaps[planet.id] = heaps
+
+        # A zone can be in more than one group (boss zones are also counted
+        # under their difficulty), so collect each one once along with every
+        # group it is in.
+        groups = {}
+        for difficulty in self.priority:
+            for zone in planet.zones(difficulty):
+                entry = groups.get(zone.id)
+                if entry is None:
+                    groups[zone.id] = (zone, [difficulty])
+                else:
+                    entry[1].append(difficulty)
+
+        rates = self._rates.setdefault(planet.id, {})
+        for zone_id, (zone, _) in groups.items():
+            rate = rates.get(zone_id)
+            if rate is None:
+                rate = CaptureRate()
+                rates[zone_id] = rate
+            rate.add(now, zone.progress)
+
+        for zone_id in list(zones):
+            if zone_id not in groups:
+                del zones[zone_id]
+                rates.pop(zone_id, None)
+
+        for zone_id, (zone, difficulties) in groups.items():
+            current = zones.get(zone_id)
+            state = self._zone_state(zone)
+            if current is not None and current[2] == state:
+                # Keep the new object so callers see the latest game id, but
+                # the heap entries are still good.
+                zones[zone_id] = (zone, current[1], state)
+                continue
+            stamp = next(self._stamps)
+            zones[zone_id] = (zone, stamp, state)
+            for difficulty in difficulties:
+                heapq.heappush(heaps[difficulty], (zone.progress, zone_id, stamp))
+
+        for difficulty, heap in heaps.items():
+            # Stale entries pile up when zones change often.  Rebuild the heap
+            # once they outnumber the live ones.
+            if len(heap) > 2 * len(zones) + 16:
+                live = [e for e in heap if zones.get(e[1], (None, None))[1] == e[2]]
+                heapq.heapify(live)
+                heaps[difficulty] = live
+
+    def _planet_live(self, entry):
+        current = self._planet_entries.get(entry[-2])
+        return current is not None and current[2] == entry[-1]
+
+    @staticmethod
+    def _zone_state(zone):
+        return (zone.progress, zone.type, zone.difficulty, zone.boss_active)
@@ -1,51 +1,183 @@
 # -*- coding: utf-8 -*-
 
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import sys
 
-from api import Client
+import checkpoint
+import fleet
+import metrics
+import tracing
+from api import Client, _HOST
 from bot import Bot
+from coordinator import BossWatcher
+from ratelimit import RateLimiter
+from recorder import Recorder
 
 DEBUG = 'SALIENBOT_DEBUG' in os.environ
+PLANET_WORKERS = int(os.environ.get('SALIENBOT_PLANET_WORKERS', 8))
+# Set this to the address of mockserver.py to play against it instead.
+HOST = os.environ.get('SALIENBOT_HOST', _HOST)
+# Serve Prometheus metrics on this port, and/or write them to this file for
+# node_exporter's textfile collector.
+METRICS_PORT = os.environ.get('SALIENBOT_METRICS_PORT')
+METRICS_FILE = os.environ.get('SALIENBOT_METRICS_FILE')
+# Write a Chrome trace of every round to this file on exit, and with
+# SALIENBOT_PROFILE also sample stacks into a .folded file next to it.
+TRACE_FILE = os.environ.get('SALIENBOT_TRACE')
+PROFILE = 'SALIENBOT_PROFILE' in os.environ
+# Leave a regular round for a boss that spawns while less than this fraction
+# of the round has passed.  1 always leaves, 0 never does.
+BOSS_PREEMPT = float(os.environ.get('SALIENBOT_BOSS_PREEMPT', 1))
+# Requests per second for all accounts together.  Processes given the same
+# SALIENBOT_RATE_LIMIT_FILE share one budget.
+RATE_LIMIT = os.environ.get('SALIENBOT_RATE_LIMIT')
+RATE_LIMIT_FILE = os.environ.get('SALIENBOT_RATE_LIMIT_FILE')
+# Each account saves the round it is in to a file in this directory, so a
+# restart can finish the round instead of leaving it.  Set it to an empty
+# string to turn this off.
+CHECKPOINT_DIR = os.environ.get('SALIENBOT_CHECKPOINT_DIR', 'checkpoints')
+# Record every request and response, without tokens, to this gzip file for
+# replay.py.
+RECORD_FILE = os.environ.get('SALIENBOT_RECORD')
+# With several accounts, log a summary of the whole fleet every this many
+# seconds instead of every account's rounds.
+SUMMARY_INTERVAL = os.environ.get('SALIENBOT_SUMMARY')
+if SUMMARY_INTERVAL is not None:
+    SUMMARY_INTERVAL = float(SUMMARY_INTERVAL)
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print('usage: python main.py token steamid')
-        sys.exit(-1)
+USAGE = '''usage: python main.py token steamid
+       python main.py --accounts accounts.txt'''
 
-    token = sys.argv[1]
-    steamid64 = int(sys.argv[2])
-    steamid32 = steamid64 & 0xFFFFFFFF
 
+def setup_logging(multi_account=False, summary=False):
+    # The bots only put records on a queue.  Formatting them and writing them
+    # to the console and debug.log happens on the listener's thread, so slow
+    # I/O doesn't hold up a round.  Returns the listener; stop it to flush
+    # the queue before exiting without atexit.
     logger = logging.getLogger('')
+
+    # With several accounts in one process every line needs to say which
+    # account it came from.
+    account_format = ''
+    if multi_account:
+        account_format = '%(account)-12s '
+
+    handlers = []
     if DEBUG:
         file_handler = logging.FileHandler('debug.log', encoding='utf-8')
         file_handler.setLevel(logging.DEBUG)
         file_formatter = logging.Formatter(
-            '%(asctime)s %(name)-8s %(levelname)-8s %(message)s',
+            f'%(asctime)s {account_format}%(name)-8s %(levelname)-8s %(message)s',
             datefmt='%d-%m-%y %H:%M:%S',
         )
         file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
+        # Nothing would show the per-round lines, so don't format them.
+        if summary:
+            logging.getLogger('display').setLevel(logging.WARNING)
 
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_formatter = logging.Formatter(
-        '%(asctime)s %(levelname)-7s %(message)s',
+        f'%(asctime)s {account_format}%(levelname)-7s %(message)s',
         datefmt='%H:%M:%S',
     )
     console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
+    if summary:
+        console_handler.addFilter(fleet.SummaryFilter())
+    handlers.append(console_handler)
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    # The account has to be read on the thread that logged the record.
+    if multi_account:
+        queue_handler.addFilter(fleet.AccountFilter())
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def make_rate_limiter():
+    if RATE_LIMIT is None:
+        return None
+    return RateLimiter(float(RATE_LIMIT), path=RATE_LIMIT_FILE)
+
+
+def make_recorder(path=RECORD_FILE):
+    if path is None:
+        return None
+    recorder = Recorder(path).start()
+    atexit.register(recorder.close)
+    return recorder
+
+
+def setup_metrics():
+    if METRICS_PORT is not None:
+        metrics.serve(int(METRICS_PORT))
+    if METRICS_FILE is not None:
+        metrics.write_textfile_every(METRICS_FILE)
+    if TRACE_FILE is not None:
+        tracing.enable(TRACE_FILE, profile=PROFILE)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(USAGE)
+        sys.exit(-1)
+
+    if sys.argv[1] == '--accounts':
+        accounts = fleet.load_accounts(sys.argv[2])
+        if len(accounts) == 0:
+            print(f'No accounts found in {sys.argv[2]}')
+            sys.exit(-1)
+        log_listener = setup_logging(multi_account=True, summary=SUMMARY_INTERVAL is not None)
+        setup_metrics()
+        recorder = make_recorder()
+
+        try:
+            fleet.run(accounts, host=HOST, planet_workers=PLANET_WORKERS, boss_preempt=BOSS_PREEMPT,
+                      rate_limiter=make_rate_limiter(), summary_interval=SUMMARY_INTERVAL,
+                      checkpoint_dir=CHECKPOINT_DIR, recorder=recorder)
+        except KeyboardInterrupt:
+            print('exiting...')
+            tracing.close()
+            if recorder is not None:
+                recorder.close()
+            log_listener.stop()
+            # The bots are still blocked in their worker threads and would
+            # keep the interpreter alive, so don't wait for them.
+            os._exit(0)
+        tracing.close()
+        sys.exit(0)
+
+    token = sys.argv[1]
+    steamid64 = int(sys.argv[2])
+    steamid32 = steamid64 & 0xFFFFFFFF
+
+    setup_logging()
+    setup_metrics()
 
-    client = Client(token)
-    bot = Bot(client, steamid32)
+    client = Client(token, host=HOST, rate_limiter=make_rate_limiter(), recorder=make_recorder())
+    watcher = None
+    if BOSS_PREEMPT > 0:
+        watcher = BossWatcher(client)
+        watcher.start()
+    bot = Bot(client, steamid32, planet_workers=PLANET_WORKERS, boss_watcher=watcher, boss_preempt=BOSS_PREEMPT,
+              checkpoint=checkpoint.for_account(CHECKPOINT_DIR, steamid32))
 
     try:
         bot.run()
     except KeyboardInterrupt:
         print('exiting...')
         sys.exit(0)
+    finally:
+        tracing.close()
@@ -0,0 +1,271 @@
+# Prometheus-style metrics for the API client and the bots.  Metrics are kept
+# in memory and can be served over HTTP for Prometheus to scrape, or written
+# to a file for node_exporter's textfile collector.
+
+import bisect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_TURNAROUND_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric():
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f'{self.name} takes labels {self.label_names}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def expose(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._sample_lines(key, value))
+        return lines
+
+    def _sample_lines(self, key, value):
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}']
+
+    def by(self, label):
+        # Counters and gauges only.  Sums the values for each value of label,
+        # e.g. bot_rounds.by('account') -> {'1234': 10, ...}
+        index = self.label_names.index(label)
+        with self._lock:
+            items = list(self._values.items())
+        sums = {}
+        for key, value in items:
+            sums[key[index]] = sums.get(key[index], 0) + value
+        return sums
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def total(self):
+        # The sum over every set of labels.
+        with self._lock:
+            return sum(self._values.values())
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * len(self.buckets), 0, 0.0]
+                self._values[key] = state
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return 0 if state is None else state[1]
+
+    def _sample_lines(self, key, state):
+        counts, total, total_sum = state
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, [('le', _format_value(bound))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.label_names, key, [('le', '+Inf')])
+        lines.append(f'{self.name}_bucket{labels} {total}')
+        labels = _format_labels(self.label_names, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total_sum)}')
+        lines.append(f'{self.name}_count{labels} {total}')
+        return lines
+
+
+class Registry():
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def expose(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+api_request_seconds = REGISTRY.register(Histogram(
+    'salienbot_api_request_seconds', 'Time taken by each API request attempt.', ['endpoint']))
+api_retries = REGISTRY.register(Counter(
+    'salienbot_api_retries_total', 'API calls retried, by the reason they failed.', ['endpoint', 'reason']))
+api_failures = REGISTRY.register(Counter(
+    'salienbot_api_failures_total', 'API request attempts that got no response, or an HTTP error.',
+    ['endpoint', 'reason']))
+api_eresults = REGISTRY.register(Counter(
+    'salienbot_api_eresult_total', 'API responses by X-eresult.', ['endpoint', 'eresult']))
+api_backoff_seconds = REGISTRY.register(Counter(
+    'salienbot_api_backoff_seconds_total', 'Time spent sleeping between API retries.', ['endpoint']))
+api_rate_limit_seconds = REGISTRY.register(Counter(
+    'salienbot_api_rate_limit_seconds_total', 'Time requests spent waiting on the rate limiter.', ['endpoint']))
+
+bot_sleep_seconds = REGISTRY.register(Counter(
+    'salienbot_sleep_seconds_total', 'Time a bot spent sleeping, by what it was waiting for.', ['account', 'reason']))
+bot_restarts = REGISTRY.register(Counter(
+    'salienbot_restarts_total', 'Times a bot was started again after it failed.', ['account']))
+bot_startup_seconds = REGISTRY.register(Gauge(
+    'salienbot_startup_seconds', 'Time from starting the bot to its first round running.', ['account']))
+bot_uptime_seconds = REGISTRY.register(Gauge(
+    'salienbot_uptime_seconds', 'Time since the bot started.', ['account']))
+bot_boss_fights = REGISTRY.register(Gauge(
+    'salienbot_boss_fight', 'Whether the bot is in a boss fight.', ['account']))
+bot_rounds = REGISTRY.register(Counter(
+    'salienbot_rounds_total', 'Rounds played, by kind.', ['account', 'kind']))
+bot_round_turnaround_seconds = REGISTRY.register(Histogram(
+    'salienbot_round_turnaround_seconds', 'Time from reporting a score to playing the next round.',
+    ['account'], buckets=_TURNAROUND_BUCKETS))
+bot_planet_details = REGISTRY.register(Counter(
+    'salienbot_planet_details_total', 'Planet details needed, by whether they were fetched or reused.',
+    ['account', 'source']))
+bot_wasted_rounds = REGISTRY.register(Counter(
+    'salienbot_wasted_rounds_total', 'Rounds that earned nothing because the zone was captured first.', ['account']))
+bot_heals = REGISTRY.register(Counter(
+    'salienbot_boss_heals_total', 'Boss fight heals, by whether they were used or left to another account.',
+    ['account', 'outcome']))
+bot_xp = REGISTRY.register(Counter(
+    'salienbot_xp_total', 'XP earned since the bot started.', ['account']))
+bot_xp_per_hour = REGISTRY.register(Gauge(
+    'salienbot_xp_per_hour', 'XP earned per hour since the bot started.', ['account']))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(port, host='127.0.0.1', registry=REGISTRY):
+    # Serves /metrics from a background thread and returns the server.
+    handler = type('Handler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server
+
+
+def write_textfile(path, registry=REGISTRY):
+    # Written to a temporary file and renamed, so the collector never reads a
+    # half written file.
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(registry.expose())
+    os.replace(tmp, path)
+
+
+def write_textfile_every(path, interval=15, registry=REGISTRY):
+    def loop():
+        while True:
+            try:
+                write_textfile(path, registry)
+            except OSError:
+                logger.debug(f'Unable to write metrics to {path}', exc_info=True)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='metrics-textfile', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,620 @@
+# -*- coding: utf-8 -*-
+
+# A local stand-in for the Steam minigame API, for load testing and trying out
+# changes without the live service.  Start it, then point the bot at it:
+#
+#   $ python mockserver.py --port 8080 --planets 20
+#   $ SALIENBOT_HOST=http://127.0.0.1:8080 python main.py --accounts accounts.txt
+#
+# Any access token is accepted, and a new player is created the first time a
+# token is seen.
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from clock import Clock
+
+logger = logging.getLogger(__name__)
+
+ERESULT_OK = 1
+ERESULT_FAIL = 2
+ERESULT_INVALID_STATE = 11
+ERESULT_EXPIRED = 27
+ERESULT_TIME_NOT_SYNCED = 93
+
+ZONE_TYPE_NORMAL = 3
+ZONE_TYPE_BOSS = 4
+
+ZONES_PER_PLANET = 96
+
+_SCORES = {1: 600, 2: 1200, 3: 2400}
+# Share of a zone's capture progress a single reported round is worth.
+_ROUND_PROGRESS = {1: 0.02, 2: 0.01, 3: 0.005}
+
+
+class ApiError(Exception):
+    def __init__(self, eresult, message):
+        super().__init__(message)
+        self.eresult = eresult
+        self.message = message
+
+
+class Zone():
+    def __init__(self, position, planet_id, difficulty):
+        self.position = position
+        self.planet_id = planet_id
+        self.difficulty = difficulty
+        self.gameid = f'{planet_id}{position:03d}{random.randint(0, 99999):05d}'
+        self.type = ZONE_TYPE_NORMAL
+        self.captured = False
+        self.progress = 0.0
+        # Progress per second other players add to the zone.
+        self.rate = 0.0
+        self.boss = None
+
+    def to_json(self):
+        zone = {
+            'zone_position': self.position,
+            'gameid': self.gameid,
+            'type': self.type,
+            'difficulty': self.difficulty,
+            'captured': self.captured,
+            'capture_progress': self.progress,
+        }
+        if self.boss is not None and not self.boss.game_over:
+            zone['boss_active'] = True
+        return zone
+
+
+class Planet():
+    def __init__(self, planet_id, name):
+        self.id = planet_id
+        self.name = name
+        self.captured = False
+        self.players = set()
+        self.zones = []
+        for position in range(ZONES_PER_PLANET):
+            difficulty = random.choices([1, 2, 3], weights=[5, 3, 2])[0]
+            self.zones.append(Zone(position, planet_id, difficulty))
+
+    def progress(self):
+        return sum(zone.progress for zone in self.zones) / len(self.zones)
+
+    def boss_position(self):
+        for zone in self.zones:
+            if zone.boss is not None and not zone.boss.game_over:
+                return zone.position
+        return None
+
+    def to_json(self, zones=False):
+        state = {
+            'name': self.name,
+            'active': not self.captured,
+            'captured': self.captured,
+            'capture_progress': self.progress(),
+            'current_players': len(self.players),
+        }
+        boss_position = self.boss_position()
+        if boss_position is not None:
+            state['boss_zone_position'] = boss_position
+        planet = {
+            'id': str(self.id),
+            'state': state,
+        }
+        if zones:
+            planet['zones'] = [zone.to_json() for zone in self.zones]
+        return planet
+
+
+class BossGame():
+    # The fight moves on a fixed tick, like the real one, rather than on every
+    # report.  On each tick the boss hits every player still alive, and every
+    # player who reported damage since the last tick hits the boss and earns
+    # XP.  Reporting more often than the tick gains nothing, and reporting
+    # less often misses ticks.
+    def __init__(self, zone, started, boss_hp, tick=5):
+        self.zone = zone
+        self.started = started
+        self.boss_hp = boss_hp
+        self.boss_max_hp = boss_hp
+        self.tick = tick
+        # Game clock time of the last tick, set when the fight starts.
+        self.ticked = None
+        # account id -> damage_to_boss reported since the last tick
+        self.reported = {}
+        self.players = {}
+        # Cooldowns are tracked on the game clock, time_last_heal in the
+        # response is a unix timestamp like the real API sends.
+        self.last_heal = {}
+        self.lasers = 0
+        self.heals = 0
+        self.game_over = False
+
+
+class Player():
+    def __init__(self, token):
+        self.token = token
+        self.accountid = random.randint(1, 0xFFFFFFFF)
+        self.name = f'player-{token[:8]}'
+        self.level = 1
+        self.score = 0
+        self.planet = None
+        self.planet_joined = 0
+        self.zone = None
+        self.zone_joined = 0
+
+    def next_level_score(self):
+        return self.level * 10000
+
+    def add_score(self, score):
+        self.score += score
+        while self.score >= self.next_level_score():
+            self.level += 1
+
+
+class Game():
+    def __init__(self, planets=10, round_seconds=110, boss_chance=0.01,
+                 boss_hp=1000000, boss_wait=10, boss_tick=5, capture_rate=0, clock=None):
+        self.round_seconds = round_seconds
+        # Chance per GetPlanets call that a new boss spawns somewhere.
+        self.boss_chance = boss_chance
+        self.boss_hp = boss_hp
+        # Seconds a boss game waits for players before the fight starts, and
+        # seconds between its ticks after that.
+        self.boss_wait = boss_wait
+        self.boss_tick = boss_tick
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+
+        self.planets = {}
+        for planet_id in range(1, planets + 1):
+            self.planets[planet_id] = Planet(planet_id, f'Planet {planet_id}')
+        # Mean progress per second the other players add to each zone.  Each
+        # zone gets its own rate, up to twice this.
+        if capture_rate > 0:
+            for planet in self.planets.values():
+                for zone in planet.zones:
+                    zone.rate = random.uniform(0, 2 * capture_rate)
+        self._ticked = self.clock.monotonic()
+        self.players = {}
+        self.rounds = 0
+        self.lock = threading.Lock()
+
+    def player(self, params):
+        token = params.get('access_token')
+        if token is None:
+            raise ApiError(ERESULT_FAIL, 'missing access_token')
+        player = self.players.get(token)
+        if player is None:
+            player = Player(token)
+            self.players[token] = player
+        return player
+
+    def _planet(self, planet_id):
+        planet = self.planets.get(int(planet_id))
+        if planet is None:
+            raise ApiError(ERESULT_INVALID_STATE, f'no planet {planet_id}')
+        return planet
+
+    def _maybe_spawn_boss(self):
+        if random.random() >= self.boss_chance:
+            return
+        planets = [p for p in self.planets.values() if not p.captured and p.boss_position() is None]
+        if len(planets) == 0:
+            return
+        planet = random.choice(planets)
+        # Don't turn a zone someone is playing a round in into a boss zone
+        # under them.
+        busy = {id(p.zone) for p in self.players.values() if p.zone is not None}
+        zones = [z for z in planet.zones if not z.captured and id(z) not in busy]
+        if len(zones) == 0:
+            return
+        zone = random.choice(zones)
+        zone.type = ZONE_TYPE_BOSS
+        zone.boss = BossGame(zone, self.clock.monotonic(), self.boss_hp, self.boss_tick)
+        logger.info(f'Boss spawned on planet {planet.id} zone {zone.position}')
+
+    def _tick(self):
+        # Moves the zones along by however long it has been since the last
+        # call.
+        now = self.clock.monotonic()
+        elapsed = now - self._ticked
+        self._ticked = now
+        for planet in self.planets.values():
+            if planet.captured:
+                continue
+            for zone in planet.zones:
+                if zone.rate > 0 and not zone.captured and zone.boss is None:
+                    self._capture(zone, zone.rate * elapsed)
+
+    def _capture(self, zone, progress):
+        zone.progress = min(1.0, zone.progress + progress)
+        if zone.progress >= 1.0:
+            # A finished boss game stays attached to the zone so the players
+            # still in it keep getting game_over until they leave.
+            zone.captured = True
+            zone.type = ZONE_TYPE_NORMAL
+            planet = self.planets[zone.planet_id]
+            planet.captured = all(z.captured for z in planet.zones)
+
+    def _leave_zone(self, player):
+        if player.zone is not None and player.zone.boss is not None:
+            player.zone.boss.players.pop(player.accountid, None)
+        player.zone = None
+
+    # API methods, named after the endpoints they implement.
+
+    def GetPlanets(self, params):
+        self._tick()
+        self._maybe_spawn_boss()
+        active_only = params.get('active_only', '0') == '1'
+        planets = [p.to_json() for p in self.planets.values() if not (active_only and p.captured)]
+        return {'planets': planets}
+
+    def GetPlanet(self, params):
+        self._tick()
+        planet = self._planet(params.get('id'))
+        return {'planets': [planet.to_json(zones=True)]}
+
+    def GetPlayerInfo(self, params):
+        player = self.player(params)
+        now = self.clock.monotonic()
+        info = {
+            'level': player.level,
+            'score': str(player.score),
+            'next_level_score': str(player.next_level_score()),
+        }
+        if player.planet is not None:
+            info['active_planet'] = str(player.planet.id)
+            info['time_on_planet'] = int(now - player.planet_joined)
+        if player.zone is not None:
+            info['active_zone_position'] = str(player.zone.position)
+            info['time_in_zone'] = int(now - player.zone_joined)
+            if player.zone.boss is not None:
+                info['active_boss_game'] = player.zone.gameid
+            else:
+                info['active_zone_game'] = player.zone.gameid
+        return info
+
+    def JoinPlanet(self, params):
+        player = self.player(params)
+        planet = self._planet(params.get('id'))
+        if player.planet is not None:
+            raise ApiError(ERESULT_INVALID_STATE, 'already on a planet')
+        if planet.captured:
+            raise ApiError(ERESULT_EXPIRED, 'planet captured')
+        player.planet = planet
+        player.planet_joined = self.clock.monotonic()
+        planet.players.add(player.token)
+        return {}
+
+    def _join(self, params, boss):
+        self._tick()
+        player = self.player(params)
+        if player.planet is None:
+            raise ApiError(ERESULT_INVALID_STATE, 'not on a planet')
+        if player.zone is not None:
+            raise ApiError(ERESULT_INVALID_STATE, 'already in a zone')
+        position = int(params.get('zone_position'))
+        if position < 0 or position >= len(player.planet.zones):
+            raise ApiError(ERESULT_INVALID_STATE, f'no zone {position}')
+        zone = player.planet.zones[position]
+        if zone.captured:
+            raise ApiError(ERESULT_EXPIRED, 'zone captured')
+        if boss != (zone.boss is not None):
+            raise ApiError(ERESULT_INVALID_STATE, 'wrong zone type')
+        player.zone = zone
+        player.zone_joined = self.clock.monotonic()
+        if boss:
+            zone.boss.players[player.accountid] = {
+                'accountid': player.accountid,
+                'name': player.name,
+                'hp': 100000,
+                'max_hp': 100000,
+                'xp_earned': 0,
+                'time_last_heal': 0,
+                'level_on_join': player.level,
+            }
+            return {}
+        return {'zone_info': zone.to_json()}
+
+    def JoinZone(self, params):
+        return self._join(params, boss=False)
+
+    def JoinBossZone(self, params):
+        return self._join(params, boss=True)
+
+    def RepresentClan(self, params):
+        self.player(params)
+        return {}
+
+    def ReportScore(self, params):
+        player = self.player(params)
+        zone = player.zone
+        if zone is None or zone.boss is not None:
+            raise ApiError(ERESULT_INVALID_STATE, 'not in a zone')
+        if self.clock.monotonic() - player.zone_joined < self.round_seconds:
+            raise ApiError(ERESULT_TIME_NOT_SYNCED, 'reported too early')
+        self._tick()
+        if zone.captured:
+            # Captured by someone else while we were playing it.
+            self._leave_zone(player)
+            raise ApiError(ERESULT_EXPIRED, 'zone captured')
+        score = int(params.get('score', 0))
+        if score > _SCORES[zone.difficulty]:
+            raise ApiError(ERESULT_INVALID_STATE, 'score too high')
+
+        old_score = player.score
+        old_level = player.level
+        player.add_score(score)
+        self._capture(zone, _ROUND_PROGRESS[zone.difficulty])
+        self._leave_zone(player)
+        self.rounds += 1
+        return {
+            'old_score': str(old_score),
+            'old_level': old_level,
+            'new_score': str(player.score),
+            'new_level': player.level,
+            'next_level_score': str(player.next_level_score()),
+        }
+
+    def ReportBossDamage(self, params):
+        player = self.player(params)
+        zone = player.zone
+        if zone is None or zone.boss is None:
+            raise ApiError(ERESULT_INVALID_STATE, 'not in a boss zone')
+        game = zone.boss
+        now = self.clock.monotonic()
+        if now - game.started < self.boss_wait:
+            return {'waiting_for_players': True}
+
+        # Ticks that passed since the last report are played out first, so
+        # this report counts towards the next one.
+        self._tick_boss(game, now)
+        me = game.players[player.accountid]
+        if me['hp'] > 0 and not game.game_over:
+            damage_to_boss = int(params.get('damage_to_boss', 0))
+            if damage_to_boss > 0:
+                game.reported[player.accountid] = damage_to_boss
+            me['hp'] = max(0, me['hp'] - int(params.get('damage_taken', 0)))
+            last_heal = game.last_heal.get(player.accountid)
+            if params.get('use_heal_ability') == '1' and (last_heal is None or now - last_heal >= 120):
+                game.last_heal[player.accountid] = now
+                me['time_last_heal'] = int(self.clock.time())
+                game.heals += 1
+                for p in game.players.values():
+                    if p['hp'] > 0:
+                        p['hp'] = min(p['max_hp'], p['hp'] + p['max_hp'] // 4)
+
+        return {
+            'boss_status': {
+                'boss_hp': game.boss_hp,
+                'boss_max_hp': game.boss_max_hp,
+                'boss_players': [dict(p) for p in game.players.values()],
+            },
+            'waiting_for_players': False,
+            'game_over': game.game_over,
+            'num_laser_uses': game.lasers,
+            'num_team_heals': game.heals,
+        }
+
+    def _tick_boss(self, game, now):
+        if game.ticked is None:
+            game.ticked = game.started + self.boss_wait
+        while not game.game_over and game.ticked + game.tick <= now:
+            game.ticked += game.tick
+            for accountid, p in game.players.items():
+                if p['hp'] <= 0:
+                    continue
+                damage_to_boss = game.reported.get(accountid, 0)
+                if damage_to_boss > 0:
+                    game.boss_hp = max(0, game.boss_hp - damage_to_boss * random.randint(1000, 5000))
+                    p['xp_earned'] += 2500
+                p['hp'] = max(0, p['hp'] - random.randint(0, 3000))
+            game.reported.clear()
+
+            # The fight ends when the boss dies or the whole team does.
+            wiped = all(p['hp'] <= 0 for p in game.players.values())
+            if game.boss_hp <= 0 or wiped:
+                game.game_over = True
+                for p in game.players.values():
+                    self.players_by_account(p['accountid']).add_score(p['xp_earned'])
+                self._capture(game.zone, 1.0)
+                self.rounds += 1
+
+    def players_by_account(self, accountid):
+        for player in self.players.values():
+            if player.accountid == accountid:
+                return player
+        return None
+
+    def LeaveGame(self, params):
+        player = self.player(params)
+        gameid = params.get('gameid')
+        if player.zone is not None and player.zone.gameid == gameid:
+            self._leave_zone(player)
+        elif player.planet is not None and str(player.planet.id) == gameid:
+            if player.zone is not None:
+                raise ApiError(ERESULT_INVALID_STATE, 'leave the zone first')
+            player.planet.players.discard(player.token)
+            player.planet = None
+        # Like the real API, leaving a game we aren't in is not an error.
+        return {}
+
+
+class Stats():
+    def __init__(self, clock):
+        self.clock = clock
+        self.started = clock.monotonic()
+        self.requests = {}
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, failed=False):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if failed:
+                self.failures += 1
+
+    def summary(self, rounds):
+        with self.lock:
+            elapsed = max(self.clock.monotonic() - self.started, 1e-9)
+            total = sum(self.requests.values())
+            return {
+                'elapsed': elapsed,
+                'requests': total,
+                'requests_per_second': total / elapsed,
+                'injected_failures': self.failures,
+                'rounds': rounds,
+                'rounds_per_hour': rounds / elapsed * 3600,
+                'by_endpoint': dict(self.requests),
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Set by make_server().
+    game = None
+    stats = None
+    latency = (0, 0)
+    failure_rate = 0.0
+    eresult_failure_rate = 0.0
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self._handle(url.path, parse_qs(url.query))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        params = parse_qs(url.query)
+        params.update(parse_qs(body))
+        self._handle(url.path, params)
+
+    def _handle(self, path, params):
+        params = {key: values[0] for key, values in params.items()}
+        if path.rstrip('/') == '/stats':
+            with self.game.lock:
+                rounds = self.game.rounds
+            self._send(200, ERESULT_OK, self.stats.summary(rounds), wrap=False)
+            return
+
+        # /IService/Method/v0001/
+        parts = path.strip('/').split('/')
+        endpoint = parts[1] if len(parts) == 3 else ''
+        method = getattr(self.game, endpoint, None)
+        if method is None or not endpoint[:1].isupper():
+            self.stats.record(endpoint)
+            self._send(404, ERESULT_FAIL, None, 'unknown method')
+            return
+
+        low, high = self.latency
+        if high > 0:
+            time.sleep(random.uniform(low, high))
+
+        if random.random() < self.failure_rate:
+            self.stats.record(endpoint, failed=True)
+            self._send(500, ERESULT_FAIL, None, 'injected failure')
+            return
+        if random.random() < self.eresult_failure_rate:
+            self.stats.record(endpoint, failed=True)
+            self._send(200, ERESULT_FAIL, None, 'injected eresult failure')
+            return
+
+        self.stats.record(endpoint)
+        try:
+            with self.game.lock:
+                result = method(params)
+        except ApiError as e:
+            self._send(200, e.eresult, None, e.message)
+            return
+        self._send(200, ERESULT_OK, result)
+
+    def _send(self, status, eresult, result, error_message=None, wrap=True):
+        if wrap:
+            # Errors still get an empty response, like the real service sends.
+            if result is None:
+                result = {}
+            result = {'response': result}
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-eresult', str(eresult))
+        if error_message is not None:
+            self.send_header('X-error_message', error_message)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(host='127.0.0.1', port=8080, game=None, latency=(0, 0),
+                failure_rate=0.0, eresult_failure_rate=0.0):
+    if game is None:
+        game = Game()
+    handler = type('Handler', (Handler,), {
+        'game': game,
+        'stats': Stats(game.clock),
+        'latency': latency,
+        'failure_rate': failure_rate,
+        'eresult_failure_rate': eresult_failure_rate,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _report(server, interval):
+    while True:
+        time.sleep(interval)
+        with server.RequestHandlerClass.game.lock:
+            rounds = server.RequestHandlerClass.game.rounds
+        summary = server.RequestHandlerClass.stats.summary(rounds)
+        logger.info(f'{summary["requests"]} requests ({summary["requests_per_second"]:.1f}/s) - '
+                    f'{summary["rounds"]} rounds ({summary["rounds_per_hour"]:.0f}/h) - '
+                    f'{summary["injected_failures"]} injected failures')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local mock of the Steam minigame API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--planets', type=int, default=10)
+    parser.add_argument('--round-seconds', type=float, default=110,
+                        help='seconds a player must be in a zone before ReportScore is accepted')
+    parser.add_argument('--boss-chance', type=float, default=0.01,
+                        help='chance per GetPlanets call that a boss spawns')
+    parser.add_argument('--capture-rate', type=float, default=0.0,
+                        help='mean capture progress per second other players add to each zone')
+    parser.add_argument('--boss-tick', type=float, default=5,
+                        help='seconds between the ticks of a boss fight')
+    parser.add_argument('--latency', type=float, nargs=2, default=(0, 0), metavar=('MIN', 'MAX'),
+                        help='random delay added to every request, in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of requests that fail with HTTP 500')
+    parser.add_argument('--eresult-failure-rate', type=float, default=0.0,
+                        help='fraction of requests that fail with a bad X-eresult')
+    parser.add_argument('--report-interval', type=float, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-7s %(message)s', datefmt='%H:%M:%S')
+
+    game = Game(planets=args.planets, round_seconds=args.round_seconds, boss_chance=args.boss_chance,
+                boss_tick=args.boss_tick, capture_rate=args.capture_rate)
+    server = make_server(args.host, args.port, game, tuple(args.latency),
+                         args.failure_rate, args.eresult_failure_rate)
+    threading.Thread(target=_report, args=(server, args.report_interval), daemon=True).start()
+    logger.info(f'Mock API listening on http://{args.host}:{args.port}/ - stats at /stats')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,138 @@
+import logging
+import os
+import struct
+import threading
+
+from clock import Clock
+
+# Bucket state can be shared between processes through a file, which needs
+# fcntl.  Without it buckets are only shared between threads.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Calls that hold up a round if they are late.  The rest, like GetPlanet
+# refreshes, can wait.
+PRIORITY_ENDPOINTS = ('ReportScore', 'ReportBossDamage')
+
+_STATE = struct.Struct('dd')
+
+
+class _LocalState():
+    # Bucket state shared by the threads of one process.
+    def __init__(self):
+        self._value = None
+        self._lock = threading.Lock()
+
+    def update(self, func):
+        with self._lock:
+            self._value, result = func(self._value)
+            return result
+
+
+class _FileState():
+    # Bucket state shared by every process on the host that uses the same
+    # file.  The file is locked while the state is read and written.
+    def __init__(self, path):
+        self.path = path
+        # flock doesn't keep threads of one process apart, so they take this
+        # first.
+        self._lock = threading.Lock()
+
+    def update(self, func):
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                data = os.pread(fd, _STATE.size, 0)
+                value = _STATE.unpack(data) if len(data) == _STATE.size else None
+                value, result = func(value)
+                os.pwrite(fd, _STATE.pack(*value), 0)
+                return result
+            finally:
+                os.close(fd)
+
+
+class TokenBucket():
+    # rate tokens are added every second, up to burst.  Every request takes
+    # one.
+    def __init__(self, rate, burst=None, path=None, clock=None):
+        self.rate = rate
+        if burst is None:
+            burst = max(1, rate)
+        self.burst = burst
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+        if path is not None and fcntl is None:
+            logger.warning(f'Unable to share rate limits through {path} on this platform')
+            path = None
+        self._state = _LocalState() if path is None else _FileState(path)
+
+    def take(self, reserve=0):
+        # Takes a token if there is one to spare beyond reserve.  Returns 0
+        # if it did, or how many seconds until one will be free.  A bucket
+        # never holds more than burst, so that is all a take can wait for,
+        # whatever the reserve.
+        need = min(self.burst, 1 + reserve)
+
+        def take(value):
+            now = self.clock.monotonic()
+            if value is None:
+                tokens = self.burst
+            else:
+                tokens, stamp = value
+                tokens = min(self.burst, tokens + max(0, now - stamp) * self.rate)
+            if tokens >= need:
+                return (tokens - 1, now), 0
+            return (tokens, now), (need - tokens) / self.rate
+
+        return self._state.update(take)
+
+
+class RateLimiter():
+    # Spaces out requests with a global token bucket and optional buckets for
+    # single endpoints.  Give every client in a fleet the same limiter, and
+    # give processes the same path, so they all share one budget.
+    #
+    # Requests to PRIORITY_ENDPOINTS can use the whole bucket, the rest have
+    # to leave reserve of it for them, so a burst of planet refreshes can't
+    # make a score report late.  The reserve is cut down to what the bucket
+    # can hold beyond one token, which at a rate of 1 with the default
+    # burst is nothing.
+    def __init__(self, rate, burst=None, endpoint_rates=None, reserve=0.2,
+                 priority=PRIORITY_ENDPOINTS, path=None, clock=None):
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+        self.bucket = TokenBucket(rate, burst, path, clock)
+        self.reserve = min(reserve * self.bucket.burst, self.bucket.burst - 1)
+        self.priority = set(priority)
+        # endpoint name -> requests per second, e.g. {'GetPlanet': 2}
+        self.endpoint_buckets = {}
+        for endpoint, endpoint_rate in (endpoint_rates or {}).items():
+            endpoint_path = None if path is None else f'{path}.{endpoint}'
+            self.endpoint_buckets[endpoint] = TokenBucket(endpoint_rate, path=endpoint_path, clock=clock)
+
+    def acquire(self, endpoint):
+        # Blocks until endpoint may send a request and returns the seconds
+        # spent waiting.
+        waited = 0
+        bucket = self.endpoint_buckets.get(endpoint)
+        if bucket is not None:
+            waited += self._take(bucket, 0)
+        reserve = 0 if endpoint in self.priority else self.reserve
+        waited += self._take(self.bucket, reserve)
+        return waited
+
+    def _take(self, bucket, reserve):
+        waited = 0
+        while True:
+            wait = bucket.take(reserve)
+            if wait == 0:
+                return waited
+            self.clock.sleep(wait)
+            waited += wait
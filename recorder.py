@@ -0,0 +1,115 @@
+# Records the API traffic of a run so it can be replayed offline with
+# replay.py.  Every request attempt becomes one JSON line in a gzip file: when
+# it was sent, how long it took, the endpoint and its parameters, the status,
+# X-eresult and the decoded response.  Attempts that failed with a timeout,
+# connection or HTTP error are there too, with the error in place of the
+# response.  Access tokens are never written; each client is told apart by a
+# hash of its token instead.
+#
+# Clients only queue their records, a background thread writes them, so a
+# slow disk doesn't hold up a round.  At most max_pending records are queued
+# and the rest are dropped and counted, so memory stays bounded if the
+# writer falls behind.  None queues everything, for runs like simulate.py
+# that produce records faster than real time.
+
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def client_id(token):
+    # Stands in for the token in the recording.
+    if token is None:
+        return None
+    return hashlib.sha256(str(token).encode('utf-8')).hexdigest()[:12]
+
+
+class Recorder():
+    def __init__(self, path, max_pending=1000, flush_interval=1):
+        self.path = path
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        # Serializes writes between the background thread and close().
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        # Set to flush before flush_interval is up.
+        self._wake = threading.Event()
+        self._thread = None
+        # Appending adds a new gzip member to the file, which readers see as
+        # one stream.
+        self._file = gzip.open(path, 'ab')
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._write_lock:
+            self._file.close()
+        if self.dropped > 0:
+            logger.warning(f'Dropped {self.dropped} records the recorder could not keep up with')
+
+    def record(self, entry):
+        # Never blocks on I/O.
+        with self._lock:
+            if self.max_pending is None:
+                self._pending.append(entry)
+                return
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(entry)
+            if len(self._pending) == self.max_pending // 2:
+                self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.debug(f'Unable to write to {self.path}', exc_info=True)
+
+    def flush(self):
+        with self._lock:
+            entries = self._pending
+            self._pending = collections.deque()
+        if len(entries) == 0:
+            return
+        data = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+        with self._write_lock:
+            if self._file.closed:
+                return
+            self._file.write(data.encode('utf-8'))
+            # A sync flush, so everything written so far can be read back
+            # even if we never get to close the file.
+            self._file.flush()
+
+
+def read(path):
+    # Returns the records in a recording, in the order they were written.  A
+    # recording cut short by a crash is read up to where it stops.
+    records = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if line.endswith('\n'):
+                    records.append(json.loads(line))
+        except EOFError:
+            pass
+    return records
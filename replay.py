@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# Plays the bot against a galaxy recorded with SALIENBOT_RECORD or
+# simulate.py --record, on a simulated clock.  Zones fill up, get captured and
+# spawn bosses when they did in the recording, and the bot's own joins,
+# reports and boss fights are played out by mockserver's rules.  With a fixed
+# seed the result only depends on the bot, so changes to how it picks zones or
+# plays bosses can be compared by XP and requests on the same galaxy:
+#
+#   $ python simulate.py --hours 6 --capture-rate 0.0002 --record run.jsonl.gz
+#   $ python replay.py run.jsonl.gz --seed 1
+#
+# XP is scored by mockserver's rules, so compare replays with each other.  The
+# recorded numbers are there for reference.
+
+import argparse
+import json
+import logging
+import random
+import statistics
+
+import metrics
+from bot import Bot
+from clock import SimulatedClock, SimulationFinished
+from mockserver import ZONE_TYPE_BOSS, BossGame, Game, Planet
+from recorder import read
+from simulate import LocalClient
+
+_JOIN_ENDPOINTS = ('JoinZone', 'JoinBossZone')
+
+
+class ReplayGame(Game):
+    # A mockserver.Game whose planets follow the GetPlanet responses in a
+    # recording instead of moving along by themselves.  Planets show up when
+    # they were first fetched, except that everything fetched before the
+    # recorded bot first joined a zone is there from the start.
+    def __init__(self, records, clock, **options):
+        super().__init__(planets=0, clock=clock, boss_chance=0, **options)
+        start = records[0]['t']
+        first_join = None
+        # (seconds into the recording, GetPlanet planet), oldest first.
+        self._updates = []
+        for record in records:
+            if record['endpoint'] in _JOIN_ENDPOINTS and first_join is None:
+                first_join = record['t'] - start
+            if record['endpoint'] == 'GetPlanet' and record['eresult'] == '1':
+                for planet_json in record['body'].get('planets', []):
+                    self._updates.append((record['t'] + record['elapsed'] - start, planet_json))
+        self._updates.sort(key=lambda update: update[0])
+        self._applied = 0
+        if first_join is not None:
+            self._apply_until(first_join)
+
+    def _apply_until(self, offset):
+        while self._applied < len(self._updates) and self._updates[self._applied][0] <= offset:
+            self._apply(self._updates[self._applied][1])
+            self._applied += 1
+
+    def _apply(self, planet_json):
+        planet_id = int(planet_json.get('id'))
+        state = planet_json.get('state', {})
+        planet = self.planets.get(planet_id)
+        if planet is None:
+            planet = Planet(planet_id, state.get('name'))
+            self.planets[planet_id] = planet
+        planet.captured = bool(state.get('captured'))
+        for zone_json in planet_json.get('zones', []):
+            position = zone_json.get('zone_position')
+            if position >= len(planet.zones):
+                continue
+            zone = planet.zones[position]
+            zone.gameid = zone_json.get('gameid', zone.gameid)
+            zone.difficulty = zone_json.get('difficulty', zone.difficulty)
+            # Progress never goes back, whether the replayed bot or the
+            # recording moved it last.
+            zone.progress = max(zone.progress, zone_json.get('capture_progress', 0))
+            if zone_json.get('captured'):
+                zone.captured = True
+            if zone_json.get('boss_active') and zone.boss is None and not zone.captured:
+                zone.type = ZONE_TYPE_BOSS
+                zone.boss = BossGame(zone, self.clock.monotonic(), self.boss_hp, self.boss_tick)
+
+    def _tick(self):
+        self._apply_until(self.clock.monotonic())
+        super()._tick()
+
+
+def busiest_client(records):
+    # The client that joined the most zones, which is an account rather than
+    # the boss watcher.
+    joins = {}
+    for record in records:
+        if record['client'] is not None and record['endpoint'] in _JOIN_ENDPOINTS:
+            joins[record['client']] = joins.get(record['client'], 0) + 1
+    if len(joins) == 0:
+        return None
+    return max(joins, key=joins.get)
+
+
+def recorded_result(records, client):
+    # XP is the difference between the first and last score the client saw.
+    requests = 0
+    rounds = 0
+    scores = []
+    for record in records:
+        if record['client'] != client:
+            continue
+        requests += 1
+        if record['eresult'] != '1':
+            continue
+        body = record['body']
+        if record['endpoint'] == 'GetPlayerInfo':
+            scores.append(int(body.get('score', 0)))
+        elif record['endpoint'] == 'ReportScore':
+            scores.append(int(body.get('old_score', 0)))
+            scores.append(int(body.get('new_score', 0)))
+            rounds += 1
+    return {
+        'xp': scores[-1] - scores[0] if len(scores) > 0 else 0,
+        'zone_rounds': rounds,
+        'requests': requests,
+    }
+
+
+def replay(path, client=None, seed=None, latency=None, **game_options):
+    records = read(path)
+    if len(records) == 0:
+        raise Exception(f'No records in {path}')
+    if client is None:
+        client = busiest_client(records)
+    if seed is not None:
+        random.seed(seed)
+    # Requests take as long as the recorded client's usually did.
+    if latency is None:
+        timings = [record['elapsed'] for record in records if record['client'] == client]
+        latency = statistics.median(timings) if len(timings) > 0 else 0.1
+
+    duration = records[-1]['t'] - records[0]['t']
+    clock = SimulatedClock(start=records[0]['t'], duration=duration)
+    game = ReplayGame(records, clock, **game_options)
+    api_client = LocalClient('replay', game, latency=latency)
+    bot = Bot(api_client, game.player({'access_token': 'replay'}).accountid)
+
+    try:
+        bot.run()
+    except SimulationFinished:
+        pass
+
+    player = game.players['replay']
+    elapsed = max(1, clock.elapsed())
+    return {
+        'client': client,
+        'recorded_hours': duration / 3600,
+        'recorded': recorded_result(records, client),
+        'replayed': {
+            'xp': player.score,
+            'xp_per_hour': player.score / elapsed * 3600,
+            'rounds': game.rounds,
+            'wasted_rounds': metrics.bot_wasted_rounds.value(account=bot.account_id),
+            'requests': api_client.requests,
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay the bot against a recorded galaxy')
+    parser.add_argument('recording', help='file written by SALIENBOT_RECORD or simulate.py --record')
+    parser.add_argument('--client', help='client id to compare with (default: the one that joined the most zones)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--latency', type=float, default=None,
+                        help='simulated seconds each request takes (default: as recorded)')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=level, format='%(levelname)-7s %(message)s')
+
+    result = replay(args.recording, args.client, args.seed, args.latency)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,164 @@
+import contextvars
+import logging
+import random
+import threading
+
+from clock import Clock
+
+# The retry scope the current call is running inside of, if any.  Bot starts
+# a scope around each API call and Client joins it, so both layers share one
+# deadline instead of multiplying their retries.
+_current_scope = contextvars.ContextVar('retry_scope', default=None)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'API circuit is open, retry in {retry_after:.1f} seconds')
+        self.retry_after = retry_after
+
+
+class RetryPolicy():
+    def __init__(self, max_attempts=5, base_delay=1, max_delay=30, multiplier=2,
+                 deadline=120, timeout=30, endpoint_deadlines=None,
+                 endpoint_timeouts=None, breaker=None, clock=None):
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        # Seconds a single call, including all of its retries, may take.
+        self.deadline = deadline
+        # Seconds to wait on the socket for a single request.
+        self.timeout = timeout
+        # Per-endpoint overrides, keyed by API method name (e.g. ReportScore).
+        self.endpoint_deadlines = endpoint_deadlines or {}
+        self.endpoint_timeouts = endpoint_timeouts or {}
+        if breaker is None:
+            breaker = CircuitBreaker(clock=clock)
+        self.breaker = breaker
+
+    def scope(self, endpoint=None):
+        return RetryScope(self, endpoint)
+
+    def deadline_for(self, endpoint):
+        return self.endpoint_deadlines.get(endpoint, self.deadline)
+
+    def timeout_for(self, endpoint):
+        return self.endpoint_timeouts.get(endpoint, self.timeout)
+
+    def backoff(self, attempt):
+        # Exponential backoff with "full jitter".  Spreading the sleep over the
+        # whole window keeps a fleet of bots that failed together from
+        # retrying together.
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        return random.uniform(0, ceiling)
+
+
+class RetryScope():
+    def __init__(self, policy, endpoint=None):
+        self.policy = policy
+        self.endpoint = None
+        self.attempts = 0
+        self.started = policy.clock.monotonic()
+        self.deadline_at = None
+        self.parent = None
+        self._token = None
+        if endpoint is not None:
+            self.bind(endpoint)
+
+    def __enter__(self):
+        self.parent = _current_scope.get()
+        self._token = _current_scope.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_scope.reset(self._token)
+        self._token = None
+
+    def bind(self, endpoint):
+        # A scope started without an endpoint learns it from the first request
+        # made inside of it.
+        if self.endpoint is not None:
+            return
+        self.endpoint = endpoint
+        self.deadline_at = self.started + self.policy.deadline_for(endpoint)
+        if self.parent is not None:
+            self.parent.bind(endpoint)
+            self.deadline_at = min(self.deadline_at, self.parent.deadline_at)
+
+    def remaining(self):
+        if self.deadline_at is None:
+            return self.policy.deadline
+        return max(0, self.deadline_at - self.policy.clock.monotonic())
+
+    def timeout(self):
+        # requests refuses a timeout of zero, so always give the socket at
+        # least a second.
+        return max(1, min(self.policy.timeout_for(self.endpoint), self.remaining()))
+
+    def next_delay(self):
+        # Returns how long to sleep before the next attempt, or None if we
+        # should give up.
+        self.attempts += 1
+        if self.attempts >= self.policy.max_attempts:
+            return None
+        delay = self.policy.backoff(self.attempts - 1)
+        if delay >= self.remaining():
+            return None
+        return delay
+
+
+class CircuitBreaker():
+    _CLOSED = 'closed'
+    _OPEN = 'open'
+    _HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+
+        self.state = self._CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(__name__)
+
+    def before_request(self):
+        with self._lock:
+            if self.state == self._CLOSED:
+                return
+            retry_after = self._opened_at + self.reset_timeout - self.clock.monotonic()
+            if self.state == self._OPEN and retry_after <= 0:
+                # Let a single request through to see if the API is back.
+                self.state = self._HALF_OPEN
+                return
+            raise CircuitOpenError(max(retry_after, 0))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self._CLOSED:
+                self.logger.debug('API is responding again, closing circuit')
+            self.state = self._CLOSED
+            self._failures = 0
+
+    def release(self):
+        # For a request that ended without telling us whether the API is
+        # back.  A half-open circuit lets the next request try instead.
+        with self._lock:
+            if self.state == self._HALF_OPEN:
+                self.state = self._OPEN
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self._HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self._OPEN:
+                    self.logger.debug(f'Opening circuit for {self.reset_timeout} seconds after {self._failures} failures')
+                self.state = self._OPEN
+                self._opened_at = self.clock.monotonic()
@@ -0,0 +1,154 @@
+import threading
+
+# Seconds the server wants us in a zone before it accepts a score.
+ROUND_SECONDS = 110
+
+# The eresult ReportScore gives when the round isn't over yet.
+ERESULT_TIME_NOT_SYNCED = '93'
+# The eresult ReportScore gives when the zone was captured during the round.
+ERESULT_EXPIRED = '27'
+
+
+class RttEstimator():
+    # Smoothed round-trip time in the style of TCP (RFC 6298), fed with the
+    # duration of every successful request.
+    def __init__(self, initial=0.5, alpha=0.125, beta=0.25):
+        self.alpha = alpha
+        self.beta = beta
+        self._srtt = None
+        self._rttvar = initial / 2
+        self._initial = initial
+        self._lock = threading.Lock()
+
+    def record(self, sample):
+        with self._lock:
+            if self._srtt is None:
+                self._srtt = sample
+                self._rttvar = sample / 2
+                return
+            self._rttvar = (1 - self.beta) * self._rttvar + self.beta * abs(self._srtt - sample)
+            self._srtt = (1 - self.alpha) * self._srtt + self.alpha * sample
+
+    def estimate(self):
+        with self._lock:
+            if self._srtt is None:
+                return self._initial
+            return self._srtt
+
+    def variance(self):
+        with self._lock:
+            return self._rttvar
+
+
+class ScoreScheduler():
+    # Works out when to send ReportScore so it lands at the server as soon as
+    # the round is over.  The server starts the round when it handles our
+    # JoinZone, roughly half a round trip before the response gets back to
+    # us, and a report takes about half a round trip to get there.
+    def __init__(self, clock, rtt, margin=0.25, min_margin=0.05, max_margin=5):
+        self.clock = clock
+        self.rtt = rtt
+        # Extra seconds added to the estimate.  It grows every time we are
+        # told we are early and shrinks slowly while reports are accepted.
+        self.margin = margin
+        self.min_margin = min_margin
+        self.max_margin = max_margin
+        self.early_reports = 0
+
+        self.accepted_at = None
+
+    def joined(self, returned_at=None, time_in_zone=0):
+        # returned_at is when the response telling us we are in the zone came
+        # back.  When we didn't join the zone ourselves, pass the time
+        # GetPlayerInfo came back along with its time_in_zone.
+        if returned_at is None:
+            returned_at = self.clock.monotonic()
+        self.accepted_at = returned_at - self.rtt.estimate() / 2 - time_in_zone
+
+    def resume(self, accepted_at):
+        # For a round we joined before a restart, with the accepted_at we
+        # worked out back then.
+        self.accepted_at = accepted_at
+
+    def report_at(self):
+        return self.accepted_at + ROUND_SECONDS - self.rtt.estimate() / 2 + self.margin
+
+    def horizon(self):
+        # Seconds from joining a zone now until our report would land.
+        return ROUND_SECONDS + self.margin + self.rtt.estimate()
+
+    def round_done(self):
+        # Fraction of the current round that has passed.
+        if self.accepted_at is None:
+            return 0
+        return min(1, (self.clock.monotonic() - self.accepted_at) / ROUND_SECONDS)
+
+    def wait_time(self):
+        return max(0, self.report_at() - self.clock.monotonic())
+
+    def reported(self):
+        self.margin = max(self.min_margin, self.margin * 0.9)
+
+    def reported_early(self):
+        # Returns how long to wait before trying again.
+        self.early_reports += 1
+        self.margin = min(self.max_margin, self.margin + 0.25)
+        return max(0.25, self.rtt.variance() * 4)
+
+
+class BossPacer():
+    # Decides how often to send ReportBossDamage.  Reports go out every
+    # interval seconds, counted from when the last one was sent, so the time
+    # a request takes doesn't make us slip behind the server's tick.  While
+    # the game is waiting for players we back off, and near the end of the
+    # fight or when the team is hurting we report twice as often.
+    def __init__(self, clock, interval=5, min_interval=1, max_wait_interval=20, heal_cooldown=120):
+        self.clock = clock
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_wait_interval = max_wait_interval
+        self.heal_cooldown = heal_cooldown
+
+        self._waits = 0
+        self._sent_at = None
+        self._local_heal = None
+
+    def sending(self):
+        # Call as each report goes out.
+        self._sent_at = self.clock.monotonic()
+
+    def waiting(self):
+        # Returns how long to sleep while there is nothing to fight yet.
+        delay = min(self.max_wait_interval, self.interval * 1.5 ** self._waits)
+        self._waits += 1
+        return delay
+
+    def fighting(self):
+        # The fight is on, so the next wait starts from interval again.
+        self._waits = 0
+
+    def next_delay(self, boss_hp_fraction, team_hp_fraction):
+        # Seconds from now until the next report is due.
+        urgent = boss_hp_fraction < 0.1 or team_hp_fraction < 0.5
+        delay = self.interval
+        if urgent:
+            delay = max(self.min_interval, self.interval / 2)
+        if self._sent_at is not None:
+            delay -= self.clock.monotonic() - self._sent_at
+        return max(0, delay)
+
+    def healed(self, at=None):
+        # at is the wall clock time of the heal, if it wasn't just now.
+        if at is None:
+            at = self.clock.time()
+        self._local_heal = at
+
+    def heal_cooldown_left(self, player):
+        # The server tells us when we last healed.  Fall back to when we last
+        # asked for one if it doesn't.
+        last_heal = player.get('time_last_heal') if player is not None else None
+        if last_heal is None:
+            last_heal = self._local_heal
+        if last_heal is None:
+            return 0
+        return max(0, last_heal + self.heal_cooldown - self.clock.time())
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Plays the bot against an in-process mockserver.Game on a simulated clock, so
+# a day of rounds takes seconds.  Useful for comparing strategy changes by
+# XP/hour:
+#
+#   $ python simulate.py --hours 24 --planets 10 --seed 1
+
+import argparse
+import json
+import logging
+import random
+
+import metrics
+import tracing
+from api import Client
+from bot import Bot
+from clock import SimulatedClock, SimulationFinished
+from mockserver import ApiError, Game
+from recorder import Recorder
+
+
+class LocalClient(Client):
+    # A Client that calls straight into a mockserver.Game instead of going
+    # over HTTP.
+    def __init__(self, token, game, latency=0.1, **kwargs):
+        super().__init__(token, clock=game.clock, **kwargs)
+        self.game = game
+        # Simulated seconds every request takes.
+        self.latency = latency
+        self.requests = 0
+
+    def _execute_request(self, request):
+        endpoint = Client._endpoint(request.url)
+        params = {}
+        for source in (request.params, request.data):
+            if source:
+                params.update({key: str(value) for key, value in source.items()})
+
+        self.requests += 1
+        self.clock.advance(self.latency)
+        self.rtt.record(self.latency)
+        method = getattr(self.game, endpoint)
+        sent_time = self.clock.time()
+        with tracing.span(endpoint), self.game.lock:
+            try:
+                json, eresult = method(params), '1'
+            except ApiError as e:
+                json, eresult = e.message, str(e.eresult)
+        if self.recorder is not None:
+            self._record(request, endpoint, 200, eresult, json, sent_time, self.latency)
+        return json, eresult
+
+
+def simulate(hours=24, planets=10, seed=None, latency=0.1, trace=None, record=None, **game_options):
+    if seed is not None:
+        random.seed(seed)
+    clock = SimulatedClock(duration=hours * 3600)
+    if trace is not None:
+        # Spans are timed on the simulated clock, so the trace shows where
+        # simulated time went.
+        tracing.enable(trace, clock)
+    game = Game(planets=planets, clock=clock, **game_options)
+    # The recording can be played back with replay.py.  Simulated time runs
+    # faster than a recorder can keep up with, so nothing is dropped.
+    recorder = None
+    if record is not None:
+        recorder = Recorder(record, max_pending=None).start()
+    client = LocalClient('simulated', game, latency=latency, recorder=recorder)
+    bot = Bot(client, game.player({'access_token': 'simulated'}).accountid)
+
+    try:
+        bot.run()
+    except SimulationFinished:
+        pass
+    finally:
+        tracing.close()
+        if recorder is not None:
+            recorder.close()
+
+    player = game.players['simulated']
+    elapsed = clock.elapsed()
+    return {
+        'simulated_hours': elapsed / 3600,
+        'level': player.level,
+        'xp': player.score,
+        'xp_per_hour': player.score / elapsed * 3600,
+        'rounds': game.rounds,
+        'rounds_per_hour': game.rounds / elapsed * 3600,
+        'wasted_rounds': metrics.bot_wasted_rounds.value(account=bot.account_id),
+        'requests': client.requests,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the bot on a simulated clock')
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--planets', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='simulated seconds each request takes')
+    parser.add_argument('--boss-chance', type=float, default=0.01)
+    parser.add_argument('--capture-rate', type=float, default=0.0,
+                        help='mean capture progress per second other players add to each zone')
+    parser.add_argument('--boss-tick', type=float, default=5,
+                        help='seconds between the ticks of a boss fight')
+    parser.add_argument('--trace', help='write a Chrome trace of the simulated run to this file')
+    parser.add_argument('--record', help='record the API traffic to this file for replay.py')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=level, format='%(levelname)-7s %(message)s')
+
+    result = simulate(args.hours, args.planets, args.seed, args.latency, args.trace, args.record,
+                      boss_chance=args.boss_chance, boss_tick=args.boss_tick, capture_rate=args.capture_rate)
+    print(json.dumps(result, indent=2))
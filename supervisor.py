@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+# Runs the accounts in an accounts file across several worker processes, so
+# JSON decoding, TLS and logging aren't all stuck on one core:
+#
+#   $ python supervisor.py accounts.txt --workers 4
+#
+# Each worker runs its share of the accounts as a fleet, configured by the
+# same SALIENBOT_* environment variables as main.py.  A worker that dies is
+# started again with backoff.  One that keeps dying is retired and its
+# accounts are shared out among the others.  Every --report-interval seconds
+# the supervisor logs each worker's throughput.
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import fleet
+import main
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def shard(accounts, workers):
+    # Deals the accounts out like cards, so every worker gets a similar share.
+    shards = [[] for _ in range(workers)]
+    for i, account in enumerate(accounts):
+        shards[i % workers].append(account)
+    return shards
+
+
+def _report_stats(stats, stopping, interval, exit):
+    # Sends the worker's counters until the supervisor asks it to stop, and
+    # then exits the worker from here, so it never goes down halfway through
+    # sending.  A worker whose supervisor is gone stops too.
+    while not stopping.wait(interval):
+        try:
+            stats.send((os.getpid(), time.monotonic(), metrics.bot_rounds.total(), metrics.bot_xp.total(),
+                        metrics.api_eresults.total()))
+        except OSError:
+            break
+    exit()
+
+
+def _worker(index, accounts, stats, stopping, report_interval):
+    # Runs in the worker process.
+    log_listener = main.setup_logging(multi_account=True, summary=main.SUMMARY_INTERVAL is not None)
+    # Workers can't append to one gzip file together, so each gets its own.
+    recorder = None
+    if main.RECORD_FILE is not None:
+        recorder = main.make_recorder(f'{main.RECORD_FILE}.{index}')
+
+    def exit():
+        # The bots are blocked in their threads, so don't wait for them.
+        if recorder is not None:
+            recorder.close()
+        log_listener.stop()
+        os._exit(0)
+
+    thread = threading.Thread(target=_report_stats, args=(stats, stopping, report_interval, exit), daemon=True)
+    thread.start()
+    try:
+        fleet.run(accounts, host=main.HOST, planet_workers=main.PLANET_WORKERS, boss_preempt=main.BOSS_PREEMPT,
+                  rate_limiter=main.make_rate_limiter(), summary_interval=main.SUMMARY_INTERVAL,
+                  checkpoint_dir=main.CHECKPOINT_DIR, recorder=recorder)
+    except KeyboardInterrupt:
+        exit()
+
+
+class Worker():
+    def __init__(self, index, accounts):
+        self.index = index
+        self.accounts = accounts
+        self.process = None
+        # Our end of the pipe the worker sends its stats through, and the
+        # event that asks it to stop.
+        self.stats = None
+        self.stopping = None
+        self.started_at = None
+        self.restart_at = None
+        # Failures since the worker last stayed up for a while, and in total.
+        self.failures = 0
+        self.restarts = 0
+        # (pid, time, rounds, xp, requests) from the worker at the last
+        # report, and the newest one.
+        self.reported = None
+        self.latest = None
+
+
+class Supervisor():
+    def __init__(self, accounts, workers=None, restart_delay=5, max_restart_delay=300, max_failures=5,
+                 stable_after=600, report_interval=60, stop_timeout=10):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(accounts)))
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        # A worker that fails this many times in a row, without staying up
+        # for stable_after seconds in between, is retired.
+        self.max_failures = max_failures
+        self.stable_after = stable_after
+        self.report_interval = report_interval
+        # Seconds a worker gets to exit when asked before it is terminated.
+        self.stop_timeout = stop_timeout
+
+        # Workers are spawned rather than forked, since forking a process
+        # with threads running can leave locks held in the child.
+        self._context = multiprocessing.get_context('spawn')
+        self.workers = [Worker(i, accounts) for i, accounts in enumerate(shard(accounts, workers))]
+
+    def run(self):
+        for worker in self.workers:
+            self._start(worker)
+        next_report = time.monotonic() + self.report_interval
+        try:
+            while len(self.workers) > 0:
+                self._read_stats()
+                self._check_workers()
+                if time.monotonic() >= next_report:
+                    self.report()
+                    next_report += self.report_interval
+                time.sleep(1)
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stop(self.workers)
+
+    def _stop(self, workers):
+        # Asks the workers to exit, and only terminates those that haven't
+        # within stop_timeout.  Each worker has a pipe of its own, so one
+        # terminated while it was sending can't garble the others' stats.
+        running = [worker for worker in workers if worker.process is not None]
+        for worker in running:
+            worker.stopping.set()
+        deadline = time.monotonic() + self.stop_timeout
+        for worker in running:
+            worker.process.join(max(0, deadline - time.monotonic()))
+        for worker in running:
+            if worker.process.is_alive():
+                logger.warning(f'Worker {worker.index} did not stop within {self.stop_timeout} seconds, terminating it')
+                worker.process.terminate()
+                worker.process.join()
+            worker.process = None
+            self._close_stats(worker)
+
+    def _close_stats(self, worker):
+        if worker.stats is not None:
+            worker.stats.close()
+            worker.stats = None
+
+    def _start(self, worker):
+        self._close_stats(worker)
+        worker.stats, stats = self._context.Pipe(duplex=False)
+        worker.stopping = self._context.Event()
+        worker.process = self._context.Process(
+            target=_worker, name=f'worker-{worker.index}',
+            args=(worker.index, worker.accounts, stats, worker.stopping, min(10, self.report_interval)))
+        worker.process.start()
+        # The worker has its own copy now.  Without closing ours we'd never
+        # see the pipe close when the worker dies.
+        stats.close()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        worker.reported = None
+        worker.latest = None
+        names = ', '.join(account.name for account in worker.accounts)
+        logger.info(f'Started worker {worker.index} (pid {worker.process.pid}) with {len(worker.accounts)} accounts: {names}')
+
+    def _restart_now(self, worker):
+        self._stop([worker])
+        self._start(worker)
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in list(self.workers):
+            if worker.process is not None and not worker.process.is_alive():
+                exitcode = worker.process.exitcode
+                worker.process = None
+                if exitcode == 0:
+                    logger.info(f'Worker {worker.index} finished')
+                    self.workers.remove(worker)
+                    continue
+                if now - worker.started_at > self.stable_after:
+                    worker.failures = 0
+                worker.failures += 1
+                if worker.failures >= self.max_failures and len(self.workers) > 1:
+                    self._retire(worker)
+                    continue
+                delay = min(self.max_restart_delay, self.restart_delay * 2 ** (worker.failures - 1))
+                delay *= random.uniform(0.5, 1)
+                worker.restart_at = now + delay
+                logger.warning(f'Worker {worker.index} exited with {exitcode}, restarting in {delay:.0f} seconds')
+
+            if worker.process is None and worker.restart_at is not None and now >= worker.restart_at:
+                worker.restarts += 1
+                self._start(worker)
+
+    def _retire(self, worker):
+        # Hands the worker's accounts to whichever workers have the fewest,
+        # and restarts those with their new shares.
+        logger.warning(f'Worker {worker.index} keeps failing, moving its accounts to the other workers')
+        self.workers.remove(worker)
+        changed = set()
+        for account in worker.accounts:
+            target = min(self.workers, key=lambda w: len(w.accounts))
+            target.accounts.append(account)
+            changed.add(target.index)
+        for other in self.workers:
+            if other.index in changed:
+                self._restart_now(other)
+
+    def _read_stats(self):
+        for worker in self.workers:
+            while worker.stats is not None and worker.stats.poll():
+                try:
+                    sample = worker.stats.recv()
+                except EOFError:
+                    # The worker has exited.
+                    self._close_stats(worker)
+                    break
+                except Exception as e:
+                    # It was killed halfway through sending, which spoils the
+                    # rest of the pipe.
+                    logger.warning(f'Unable to read stats from worker {worker.index}: {e!r}')
+                    self._close_stats(worker)
+                    break
+                worker.latest = tuple(sample)
+                # Counters start again from zero in a new process.
+                if worker.reported is None or worker.reported[0] != worker.latest[0]:
+                    worker.reported = worker.latest
+
+    def report(self):
+        total_rounds = 0
+        total_xp = 0
+        total_requests = 0
+        for worker in self.workers:
+            if worker.latest is None or worker.reported is None:
+                logger.info(f'Worker {worker.index}: {len(worker.accounts)} accounts, no stats yet')
+                continue
+            pid, then, rounds, xp, requests = worker.reported
+            _, now, rounds_now, xp_now, requests_now = worker.latest
+            elapsed = max(1e-9, now - then)
+            rounds_rate = (rounds_now - rounds) / elapsed * 60
+            xp_rate = (xp_now - xp) / elapsed * 3600
+            requests_rate = (requests_now - requests) / elapsed
+            total_rounds += rounds_rate
+            total_xp += xp_rate
+            total_requests += requests_rate
+            logger.info(f'Worker {worker.index} (pid {pid}): {len(worker.accounts)} accounts - '
+                        f'{rounds_rate:.1f} rounds/min - {xp_rate:,.0f} XP/hour - '
+                        f'{requests_rate:.2f} requests/s - {worker.restarts} restarts')
+            worker.reported = worker.latest
+        logger.info(f'All workers: {total_rounds:.1f} rounds/min - {total_xp:,.0f} XP/hour - '
+                    f'{total_requests:.2f} requests/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the accounts in an accounts file across worker processes')
+    parser.add_argument('accounts', help='accounts file, one "token steamid [name]" per line')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--report-interval', type=float, default=60,
+                        help='seconds between throughput reports')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)-10s %(levelname)-7s %(message)s',
+                        datefmt='%H:%M:%S')
+
+    accounts = fleet.load_accounts(args.accounts)
+    if len(accounts) == 0:
+        print(f'No accounts found in {args.accounts}')
+        sys.exit(-1)
+
+    # The workers share one rate limit, which needs a file to share it
+    # through.  The environment is passed down to them.
+    if main.RATE_LIMIT is not None and main.RATE_LIMIT_FILE is None:
+        os.environ['SALIENBOT_RATE_LIMIT_FILE'] = os.path.join(tempfile.gettempdir(), f'salienbot-{os.getpid()}.ratelimit')
+
+    supervisor = Supervisor(accounts, args.workers, report_interval=args.report_interval)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        print('exiting...')
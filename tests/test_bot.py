@@ -0,0 +1,89 @@
+import random
+import threading
+import unittest
+
+import metrics
+from bot import ZONE_PRIORITY, Bot
+from clock import SimulatedClock
+from coordinator import ZoneAssigner
+from galaxy import GalaxyIndex
+from mockserver import ZONE_TYPE_BOSS, BossGame, Game
+from simulate import LocalClient
+
+
+class XpPerHourTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.game = Game(planets=1, clock=self.clock)
+        self.client = LocalClient('xp', self.game)
+        self.account_id = self.game.player({'access_token': 'xp'}).accountid
+
+    def test_restarted_bot_only_counts_its_own_xp(self):
+        # The bot before the restart earned plenty, which bot_xp still has.
+        metrics.bot_xp.inc(1000000, account=self.account_id)
+        bot = Bot(self.client, self.account_id, clock=self.clock)
+        self.clock.advance(1800)
+        bot._record_xp(600)
+        self.assertEqual(metrics.bot_xp_per_hour.value(account=self.account_id), 1200)
+
+
+class LeaveForBossTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.game = Game(planets=1, clock=self.clock)
+        client = LocalClient('boss', self.game)
+        account_id = self.game.player({'access_token': 'boss'}).accountid
+        galaxy = GalaxyIndex(ZONE_PRIORITY, self.clock)
+        self.assigner = ZoneAssigner(galaxy)
+        self.bot = Bot(client, account_id, clock=self.clock, galaxy=galaxy, assigner=self.assigner)
+        self.bot.refresh_player()
+        self.bot.planet, self.bot.zone = self.bot.choose_target()
+        self.assertTrue(self.bot.join_target())
+
+    def test_prefetch_is_settled_and_boss_claimed(self):
+        bot = self.bot
+        started = threading.Event()
+        go_on = threading.Event()
+
+        def prefetch():
+            started.set()
+            go_on.wait()
+            return bot.choose_target()
+
+        running = bot._prefetcher.submit(prefetch)
+        queued = bot._prefetcher.submit(bot.choose_target)
+        started.wait()
+        threading.Timer(0.05, go_on.set).start()
+
+        boss = (bot.planet, bot.planet.zone((bot.zone.id + 1) % 96))
+        bot._leave_for_boss(boss, running, queued)
+
+        self.assertTrue(running.done())
+        self.assertTrue(queued.cancelled())
+        self.assertEqual(self.assigner._assignments[bot.account_id], (boss[0].id, boss[1].id))
+        self.assertIs(bot._next_target, boss)
+
+
+class BossFightTest(unittest.TestCase):
+    def test_no_tick_is_missed(self):
+        random.seed(0)
+        clock = SimulatedClock()
+        game = Game(planets=1, clock=clock, boss_chance=0, boss_hp=100000)
+        zone = game.planets[1].zones[5]
+        zone.type = ZONE_TYPE_BOSS
+        zone.boss = BossGame(zone, clock.monotonic(), game.boss_hp, game.boss_tick)
+        client = LocalClient('boss', game)
+        bot = Bot(client, game.player({'access_token': 'boss'}).accountid, clock=clock)
+        bot.play_round()
+
+        boss = zone.boss
+        self.assertTrue(boss.game_over)
+        ticks = round((boss.ticked - boss.started - game.boss_wait) / boss.tick)
+        # The first report of the fight goes out before we know it started,
+        # without damage.  Every tick after that earns XP, even though every
+        # request takes latency seconds.
+        self.assertEqual(game.players['boss'].score, (ticks - 1) * 2500)
+
+
+if __name__ == '__main__':
+    unittest.main()
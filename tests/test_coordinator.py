@@ -0,0 +1,87 @@
+import random
+import unittest
+
+from bot import ZONE_BOSS, ZONE_HIGH, ZONE_LOW, ZONE_MEDIUM, ZONE_PRIORITY, Planet
+from clock import SimulatedClock
+from coordinator import ZoneAssigner
+from galaxy import GalaxyIndex
+from test_galaxy import planet_json
+
+
+def random_planet_json(planet_id, progress, rng):
+    zones = []
+    for position in range(12):
+        boss = rng.random() < 0.02
+        zones.append({
+            'zone_position': position,
+            'gameid': str(position),
+            'type': ZONE_BOSS if boss else 3,
+            'difficulty': rng.choice([ZONE_LOW, ZONE_MEDIUM, ZONE_HIGH]),
+            'captured': rng.random() < 0.2,
+            'capture_progress': progress[position],
+            'boss_active': boss,
+        })
+    return {
+        'id': str(planet_id),
+        'state': {'name': f'planet {planet_id}', 'active': True, 'captured': False},
+        'zones': zones,
+    }
+
+
+def scan_every_zone(assigner, crowd, horizon):
+    # What assign picked before it learnt to stop early.
+    galaxy = assigner.galaxy
+    best = None
+    best_key = None
+    for rank, planet in enumerate(galaxy.planets()):
+        for zone in galaxy.zones(planet.id):
+            ours = crowd.get((planet.id, zone.id), 0)
+            value = assigner.value(zone, ours)
+            if horizon is not None and galaxy.closes_in(planet.id, zone.id) <= horizon:
+                value = 0
+            key = (value, -ours, -rank, -zone.progress)
+            if best_key is None or key > best_key:
+                best = (planet, zone)
+                best_key = key
+    return best
+
+
+class ZoneAssignerTest(unittest.TestCase):
+    def test_picks_what_scanning_every_zone_picks(self):
+        rng = random.Random(0)
+        for _ in range(30):
+            clock = SimulatedClock()
+            galaxy = GalaxyIndex(ZONE_PRIORITY, clock)
+            progress = {planet_id: [rng.random() for _ in range(12)] for planet_id in range(1, 8)}
+            planets = [Planet.from_json(random_planet_json(planet_id, zones, random.Random(planet_id)))
+                       for planet_id, zones in progress.items()]
+            galaxy.update(planets)
+            # Move some zones along so that they are expected to close.
+            for planet, zones in zip(planets, progress.values()):
+                moved = [min(1, p + rng.choice([0, 0, 0.01, 0.2])) for p in zones]
+                planet.update_from_json(random_planet_json(int(planet.id), moved, random.Random(planet.id)))
+            clock.advance(30)
+            galaxy.update(planets)
+
+            assigner = ZoneAssigner(galaxy, account_progress=rng.choice([0.01, 0.1, 0.5]))
+            horizon = rng.choice([None, 60, 600])
+            for account_id in range(rng.randrange(20)):
+                assigner.assign(account_id, horizon=horizon)
+            crowd = {}
+            for target in assigner._assignments.values():
+                crowd[target] = crowd.get(target, 0) + 1
+            expected = scan_every_zone(assigner, crowd, horizon)
+            self.assertEqual(assigner.assign('new', horizon=horizon), expected)
+
+    def test_spreads_accounts_over_a_planet(self):
+        galaxy = GalaxyIndex(ZONE_PRIORITY, SimulatedClock())
+        galaxy.update([Planet.from_json(planet_json(1, [ZONE_HIGH] * 3, progress=0.99))])
+        assigner = ZoneAssigner(galaxy, account_progress=0.01)
+        targets = [assigner.assign(account_id)[1].id for account_id in range(4)]
+        self.assertEqual(sorted(targets[:3]), [0, 1, 2])
+        # The fourth has to share, and takes the least progressed zone of
+        # the best planet.
+        self.assertIn(targets[3], [0, 1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from requests.exceptions import ConnectTimeout
+
+from api import Client
+from clock import SimulatedClock
+from fleet import FleetSummary
+from retry import CircuitBreaker, RetryPolicy
+from test_recorder import UnavailableSession
+from test_retry import FailingSession
+
+
+class FleetSummaryTest(unittest.TestCase):
+    def get_planets(self, session, max_attempts=3):
+        clock = SimulatedClock()
+        breaker = CircuitBreaker(failure_threshold=10, clock=clock)
+        policy = RetryPolicy(max_attempts=max_attempts, breaker=breaker, clock=clock)
+        client = Client('token', session=session, retry_policy=policy, host='http://mock', clock=clock)
+        try:
+            client.get_planets()
+        except Exception:
+            pass
+
+    def error_line(self, *sessions):
+        summary = FleetSummary({})
+        summary._last = summary._sample()
+        for session in sessions:
+            self.get_planets(session)
+        with self.assertLogs('fleet') as logs:
+            summary.summary()
+        return logs.output[0]
+
+    def test_failed_attempts_are_errors(self):
+        # One 503, then a response.
+        self.assertIn('50.0% errors - 1 retries', self.error_line(UnavailableSession(1)))
+
+    def test_requests_that_never_got_a_response(self):
+        line = self.error_line(FailingSession(ConnectTimeout()), FailingSession(None))
+        self.assertIn('75.0% errors', line)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+from bot import ZONE_HIGH, ZONE_LOW, ZONE_PRIORITY, Bot, Planet
+from clock import SimulatedClock
+from galaxy import GalaxyIndex
+
+
+def planet_json(planet_id, difficulties, progress=0.5):
+    return {
+        'id': str(planet_id),
+        'state': {'name': f'planet {planet_id}', 'active': True, 'captured': False},
+        'zones': [{
+            'zone_position': position,
+            'gameid': str(position),
+            'type': 3,
+            'difficulty': difficulty,
+            'captured': False,
+            'capture_progress': progress,
+        } for position, difficulty in enumerate(difficulties)],
+    }
+
+
+class BestPlanetTest(unittest.TestCase):
+    def test_most_zones_by_priority(self):
+        planets = [Planet.from_json(planet_json(1, [ZONE_LOW] * 5)),
+                   Planet.from_json(planet_json(2, [ZONE_HIGH, ZONE_LOW])),
+                   Planet.from_json(planet_json(3, [ZONE_HIGH, ZONE_LOW, ZONE_LOW]))]
+        self.assertEqual(Bot.best_planet(planets).id, '3')
+
+    def test_ties_go_to_the_first_listed(self):
+        planets = [Planet.from_json(planet_json(1, [ZONE_HIGH])),
+                   Planet.from_json(planet_json(2, [ZONE_HIGH]))]
+        self.assertEqual(Bot.best_planet(planets).id, '1')
+
+
+class GalaxyIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.galaxy = GalaxyIndex(ZONE_PRIORITY, SimulatedClock())
+
+    def test_matches_best_planet(self):
+        planets = [Planet.from_json(planet_json(i, [ZONE_LOW] * i + [ZONE_HIGH] * (i % 3)))
+                   for i in range(1, 10)]
+        self.galaxy.update(planets)
+        self.assertIs(self.galaxy.best_planet(), Bot.best_planet(list(planets)))
+
+    def test_unchanged_planet_keeps_its_zones(self):
+        planet = Planet.from_json(planet_json(1, [ZONE_LOW, ZONE_LOW]))
+        self.galaxy.update([planet])
+        zones = self.galaxy._zones[planet.id]
+        self.galaxy.update([planet])
+        self.assertIs(self.galaxy._zones[planet.id], zones)
+        self.assertEqual(len(self.galaxy._zone_heaps[planet.id][ZONE_LOW]), 2)
+
+    def test_same_planet_parsed_by_another_bot_is_not_diffed(self):
+        # Bots in a fleet share the index but parse their own planets.
+        json = planet_json(1, [ZONE_LOW, ZONE_HIGH])
+        mine, theirs = Planet.from_json(json), Planet.from_json(json)
+        self.galaxy.update([mine])
+        stamps = {zone_id: entry[1] for zone_id, entry in self.galaxy._zones[mine.id].items()}
+        self.galaxy.update([theirs])
+        self.galaxy.update([mine])
+        self.assertEqual({zone_id: entry[1] for zone_id, entry in self.galaxy._zones[mine.id].items()}, stamps)
+        self.assertEqual(len(self.galaxy._zone_heaps[mine.id][ZONE_HIGH]), 1)
+
+        theirs.update_from_json(planet_json(1, [ZONE_LOW, ZONE_HIGH], progress=0.6))
+        self.galaxy.update([theirs])
+        self.assertEqual(len(self.galaxy._zone_heaps[mine.id][ZONE_HIGH]), 2)
+
+    def test_unchanged_zones_are_still_sampled(self):
+        clock = self.galaxy.clock
+        planet = Planet.from_json(planet_json(1, [ZONE_LOW]))
+        self.galaxy.update([planet])
+        planet.update_from_json(planet_json(1, [ZONE_LOW], progress=0.6))
+        clock.advance(30)
+        self.galaxy.update([planet])
+        moving = self.galaxy.closes_in(planet.id, 0)
+        # Stuck at 0.6 from now on.
+        for _ in range(8):
+            clock.advance(30)
+            self.galaxy.update([planet])
+        self.assertGreater(self.galaxy.closes_in(planet.id, 0), moving)
+
+    def test_updated_planet_is_ranked_again(self):
+        first = Planet.from_json(planet_json(1, [ZONE_LOW]))
+        second = Planet.from_json(planet_json(2, [ZONE_LOW, ZONE_LOW]))
+        self.galaxy.update([first, second])
+        self.assertIs(self.galaxy.best_planet(), second)
+
+        first.update_from_json(planet_json(1, [ZONE_HIGH], progress=0.1))
+        self.galaxy.update([first, second])
+        self.assertIs(self.galaxy.best_planet(), first)
+        self.assertIs(self.galaxy.best_zone(first.id), first.zone(0))
+
+    def test_reordered_planets(self):
+        first = Planet.from_json(planet_json(1, [ZONE_LOW]))
+        second = Planet.from_json(planet_json(2, [ZONE_LOW]))
+        self.galaxy.update([first, second])
+        self.galaxy.update([second, first])
+        self.assertIs(self.galaxy.best_planet(), second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import threading
+import unittest
+
+from api import Client
+from clock import SimulatedClock
+from mockserver import ZONE_TYPE_BOSS, BossGame, Game, make_server
+from scheduler import ERESULT_TIME_NOT_SYNCED
+
+
+class HttpErrorTest(unittest.TestCase):
+    def setUp(self):
+        self.server = make_server(port=0, game=Game(planets=1))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address
+        self.client = Client('token', host=f'http://{host}:{port}')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_error_eresult_reaches_the_client(self):
+        # Not on a planet yet.
+        message, eresult = self.client.join_zone(3)
+        self.assertEqual(eresult, '11')
+        self.assertIsInstance(message, str)
+
+    def test_early_report_reaches_the_client(self):
+        self.assertEqual(self.client.join_planet(1)[1], '1')
+        self.assertEqual(self.client.join_zone(0)[1], '1')
+        _, eresult = self.client.report_score(600)
+        self.assertEqual(eresult, ERESULT_TIME_NOT_SYNCED)
+
+
+class BossTickTest(unittest.TestCase):
+    def xp_after(self, report_every, seconds=60):
+        # XP earned by a player reporting damage every report_every seconds
+        # for seconds after the fight starts.
+        clock = SimulatedClock()
+        game = Game(planets=1, clock=clock, boss_hp=10**9, boss_wait=10, boss_tick=5)
+        zone = game.planets[1].zones[0]
+        zone.type = ZONE_TYPE_BOSS
+        zone.boss = BossGame(zone, clock.monotonic(), game.boss_hp, game.boss_tick)
+        params = {'access_token': 'boss'}
+        game.JoinPlanet(dict(params, id='1'))
+        game.JoinBossZone(dict(params, zone_position='0'))
+        clock.advance(10)
+        reports = {'damage_to_boss': '1', 'damage_taken': '0', 'use_heal_ability': '0'}
+        elapsed = 0
+        while elapsed < seconds:
+            game.ReportBossDamage(dict(params, **reports))
+            clock.advance(report_every)
+            elapsed += report_every
+        resp = game.ReportBossDamage(dict(params, **reports))
+        return resp['boss_status']['boss_players'][0]['xp_earned']
+
+    def test_xp_follows_the_tick_not_the_reports(self):
+        self.assertEqual(self.xp_after(5), 12 * 2500)
+        # Reporting faster than the tick earns nothing more.
+        self.assertEqual(self.xp_after(1), 12 * 2500)
+        # Reporting every other tick misses half of them.
+        self.assertEqual(self.xp_after(10), 6 * 2500)
+
+
+if __name__ == '__main__':
+    unittest.main()
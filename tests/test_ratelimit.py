@@ -0,0 +1,58 @@
+import unittest
+
+from clock import SimulatedClock
+from ratelimit import RateLimiter, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_refills_at_rate(self):
+        clock = SimulatedClock()
+        bucket = TokenBucket(2, burst=2, clock=clock)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0.5)
+        clock.advance(0.5)
+        self.assertEqual(bucket.take(), 0)
+
+    def test_reserve_beyond_burst_waits_for_a_full_bucket(self):
+        clock = SimulatedClock()
+        bucket = TokenBucket(1, clock=clock)
+        self.assertEqual(bucket.take(reserve=5), 0)
+        self.assertEqual(bucket.take(reserve=5), 1)
+        clock.advance(1)
+        self.assertEqual(bucket.take(reserve=5), 0)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_low_rate_does_not_starve_other_endpoints(self):
+        # With the default burst a rate of 1 leaves no room for a reserve.
+        # The duration makes a hang fail instead.
+        clock = SimulatedClock(duration=60)
+        limiter = RateLimiter(1, clock=clock)
+        self.assertEqual(limiter.acquire('GetPlanets'), 0)
+        self.assertEqual(limiter.acquire('GetPlanets'), 1)
+        self.assertEqual(limiter.acquire('ReportScore'), 1)
+
+    def test_reserve_is_kept_for_priority_endpoints(self):
+        clock = SimulatedClock(duration=60)
+        limiter = RateLimiter(10, clock=clock)
+        for _ in range(8):
+            self.assertEqual(limiter.acquire('GetPlanet'), 0)
+        # Two tokens left, which are the reserve.
+        self.assertGreater(limiter.acquire('GetPlanet'), 0)
+        limiter = RateLimiter(10, clock=clock)
+        for _ in range(8):
+            limiter.acquire('GetPlanet')
+        self.assertEqual(limiter.acquire('ReportScore'), 0)
+        self.assertEqual(limiter.acquire('ReportBossDamage'), 0)
+
+    def test_endpoint_bucket(self):
+        clock = SimulatedClock(duration=60)
+        limiter = RateLimiter(100, endpoint_rates={'GetPlanet': 1}, clock=clock)
+        self.assertEqual(limiter.acquire('GetPlanet'), 0)
+        self.assertEqual(limiter.acquire('GetPlanet'), 1)
+        self.assertEqual(limiter.acquire('GetPlanets'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from requests import Response
+from requests.exceptions import ConnectTimeout
+
+from api import Client
+from clock import SimulatedClock
+from retry import CircuitBreaker, RetryPolicy
+from test_retry import FailingSession
+
+
+class ListRecorder():
+    def __init__(self):
+        self.records = []
+
+    def record(self, entry):
+        self.records.append(entry)
+
+
+class UnavailableSession(FailingSession):
+    # Answers 503 to the first failures requests.
+    def __init__(self, failures):
+        super().__init__(None)
+        self.failures = failures
+
+    def send(self, prepped, timeout=None):
+        if self.sent >= self.failures:
+            return super().send(prepped, timeout)
+        self.sent += 1
+        resp = Response()
+        resp.status_code = 503
+        resp.headers['X-eresult'] = '20'
+        return resp
+
+
+class ClientRecordTest(unittest.TestCase):
+    def get_planets(self, session, max_attempts=3):
+        clock = SimulatedClock()
+        breaker = CircuitBreaker(failure_threshold=10, clock=clock)
+        policy = RetryPolicy(max_attempts=max_attempts, breaker=breaker, clock=clock)
+        recorder = ListRecorder()
+        client = Client('token', session=session, retry_policy=policy, host='http://mock', clock=clock,
+                        recorder=recorder)
+        try:
+            client.get_planets()
+        except Exception:
+            pass
+        return recorder.records
+
+    def test_retried_attempts_are_recorded(self):
+        records = self.get_planets(UnavailableSession(1))
+        self.assertEqual([(r['status'], r['eresult']) for r in records], [(503, '20'), (200, '1')])
+        self.assertTrue(records[0]['body'].startswith('HTTPError'))
+        self.assertNotIn('access_token', records[0]['params'])
+
+    def test_timeouts_are_recorded_when_giving_up(self):
+        records = self.get_planets(FailingSession(ConnectTimeout()), max_attempts=2)
+        self.assertEqual(len(records), 2)
+        for record in records:
+            self.assertEqual(record['endpoint'], 'GetPlanets')
+            self.assertIsNone(record['status'])
+            self.assertIsNone(record['eresult'])
+            self.assertTrue(record['body'].startswith('ConnectTimeout'))
+
+
+if __name__ == '__main__':
+    unittest.main()
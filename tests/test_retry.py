@@ -0,0 +1,101 @@
+import unittest
+
+from requests import Response
+from requests.exceptions import ChunkedEncodingError, ConnectionError, TooManyRedirects
+
+from api import Client, new_session
+from clock import SimulatedClock
+from retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+class FailingSession():
+    # A session whose requests fail with error until it is set to None.
+    def __init__(self, error):
+        self.error = error
+        self.sent = 0
+        self._session = new_session()
+
+    def prepare_request(self, request):
+        return self._session.prepare_request(request)
+
+    def send(self, prepped, timeout=None):
+        self.sent += 1
+        if self.error is not None:
+            raise self.error
+        resp = Response()
+        resp.status_code = 200
+        resp.headers['Content-Type'] = 'application/json'
+        resp.headers['X-eresult'] = '1'
+        resp._content = b'{"response": {"planets": []}}'
+        return resp
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=self.clock)
+
+    def open_circuit(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.advance(30)
+        # The trial request.
+        self.breaker.before_request()
+
+    def test_half_open_allows_one_request(self):
+        self.open_circuit()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request()
+
+    def test_released_trial_lets_the_next_request_try(self):
+        self.open_circuit()
+        self.breaker.release()
+        self.breaker.before_request()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_failed_trial_reopens(self):
+        self.open_circuit()
+        self.breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request()
+        self.clock.advance(30)
+        self.breaker.before_request()
+
+
+class ClientBreakerTest(unittest.TestCase):
+    def check_recovers_from(self, error):
+        clock = SimulatedClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+        policy = RetryPolicy(max_attempts=1, breaker=breaker, clock=clock)
+        session = FailingSession(ConnectionError())
+        client = Client('token', session=session, retry_policy=policy, host='http://mock', clock=clock)
+
+        # Opens the circuit.
+        with self.assertRaises(Exception):
+            client.get_planets()
+        # The half-open trial fails with error.
+        session.error = error
+        clock.advance(30)
+        with self.assertRaises(Exception):
+            client.get_planets()
+        # The API comes back, and the breaker has to let a request through
+        # to find out.
+        session.error = None
+        clock.advance(30)
+        planets, eresult = client.get_planets()
+        self.assertEqual(eresult, '1')
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_recovers_from_chunked_encoding_error(self):
+        self.check_recovers_from(ChunkedEncodingError())
+
+    def test_recovers_from_too_many_redirects(self):
+        self.check_recovers_from(TooManyRedirects())
+
+    def test_recovers_from_other_errors(self):
+        self.check_recovers_from(ValueError('bad body'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from clock import SimulatedClock
+from scheduler import BossPacer
+
+
+class BossPacerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.pacer = BossPacer(self.clock, interval=5, min_interval=1, max_wait_interval=20)
+
+    def test_delay_counts_from_when_the_report_was_sent(self):
+        self.pacer.sending()
+        # The request took a while.
+        self.clock.advance(1.5)
+        self.pacer.fighting()
+        self.assertEqual(self.pacer.next_delay(0.5, 1.0), 3.5)
+        self.clock.advance(10)
+        self.assertEqual(self.pacer.next_delay(0.5, 1.0), 0)
+
+    def test_reports_keep_to_the_interval(self):
+        sent = []
+        for _ in range(100):
+            sent.append(self.clock.monotonic())
+            self.pacer.sending()
+            self.clock.advance(0.3)
+            self.pacer.fighting()
+            self.clock.advance(self.pacer.next_delay(0.5, 1.0))
+        self.assertAlmostEqual(sent[-1] - sent[0], 99 * 5)
+
+    def test_urgent_reports_go_out_twice_as_often(self):
+        self.pacer.fighting()
+        self.assertEqual(self.pacer.next_delay(0.05, 1.0), 2.5)
+        self.assertEqual(self.pacer.next_delay(0.5, 0.4), 2.5)
+
+    def test_waiting_backs_off_until_the_fight_starts(self):
+        delays = [self.pacer.waiting() for _ in range(6)]
+        self.assertEqual(delays[0], 5)
+        self.assertEqual(delays, sorted(delays))
+        self.assertEqual(delays[-1], 20)
+        self.pacer.fighting()
+        self.assertEqual(self.pacer.waiting(), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import multiprocessing
+import time
+import unittest
+
+from supervisor import Supervisor
+
+
+def _ignore_stop(stopping):
+    time.sleep(60)
+
+
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.supervisor = Supervisor(['account'], workers=1, stop_timeout=0.5)
+        self.worker = self.supervisor.workers[0]
+        # Forked so the targets needn't be importable by a new interpreter.
+        self.context = multiprocessing.get_context('fork')
+
+    def start(self, target):
+        worker = self.worker
+        worker.stats, stats = self.context.Pipe(duplex=False)
+        worker.stopping = self.context.Event()
+        worker.process = self.context.Process(target=target, args=(worker.stopping,))
+        worker.process.start()
+        return stats
+
+    def test_stopped_worker_exits_by_itself(self):
+        self.start(lambda stopping: stopping.wait())
+        started = time.monotonic()
+        self.supervisor.stop()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertIsNone(self.worker.process)
+        self.assertIsNone(self.worker.stats)
+
+    def test_stuck_worker_is_terminated(self):
+        self.start(_ignore_stop)
+        process = self.worker.process
+        self.supervisor.stop()
+        self.assertLess(process.exitcode, 0)
+
+    def test_stats_from_a_worker_that_died(self):
+        stats = self.start(lambda stopping: None)
+        stats.send((1, 10.0, 5, 600, 20))
+        # Half a message, as from a worker killed while sending.
+        stats.send_bytes(b'\x80\x04\x95')
+        stats.close()
+        self.worker.process.join()
+        self.supervisor._read_stats()
+        self.assertEqual(self.worker.latest, (1, 10.0, 5, 600, 20))
+        self.assertIsNone(self.worker.stats)
+        # A closed pipe is just the end of the stats.
+        stats = self.start(lambda stopping: None)
+        stats.close()
+        self.supervisor._read_stats()
+        self.assertIsNone(self.worker.stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+# Opt-in tracing of what the bot spends its time on.  Spans are written as
+# Chrome trace events, which can be opened in chrome://tracing or Perfetto,
+# and the optional sampling profiler writes folded stacks for flamegraph.pl or
+# speedscope.
+#
+# Tracing is off until enable() is called, and span() is close to free while
+# it is off.
+
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+
+from clock import Clock
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer():
+    def __init__(self, path, clock=None, max_events=1000000):
+        self.path = path
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+        # Only the newest events are kept once there are too many.
+        self._events = collections.deque(maxlen=max_events)
+        self._thread_names = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _now(self):
+        return self.clock.monotonic() * 1e6
+
+    def _thread(self):
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self._thread_names:
+            with self._lock:
+                self._thread_names[tid] = thread.name
+        return tid
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        tid = self._thread()
+        start = self._now()
+        try:
+            yield
+        finally:
+            event = {
+                'name': name,
+                'ph': 'X',
+                'ts': start,
+                'dur': self._now() - start,
+                'pid': self._pid,
+                'tid': tid,
+            }
+            if args:
+                event['args'] = args
+            self._events.append(event)
+
+    def instant(self, name, **args):
+        event = {
+            'name': name,
+            'ph': 'i',
+            's': 't',
+            'ts': self._now(),
+            'pid': self._pid,
+            'tid': self._thread(),
+        }
+        if args:
+            event['args'] = args
+        self._events.append(event)
+
+    def flush(self):
+        with self._lock:
+            names = dict(self._thread_names)
+        events = [{
+            'name': 'thread_name',
+            'ph': 'M',
+            'pid': self._pid,
+            'tid': tid,
+            'args': {'name': name},
+        } for tid, name in names.items()]
+        events.extend(list(self._events))
+
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        os.replace(tmp, self.path)
+
+
+class Sampler():
+    # A simple sampling profiler.  Every interval seconds it looks at what
+    # each thread is running and counts the stack, and write() saves the
+    # counts in the folded format flame graph tools read.
+    def __init__(self, path, interval=0.01):
+        self.path = path
+        self.interval = interval
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                self._stacks[';'.join(reversed(stack))] += 1
+
+    def write(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+_tracer = None
+_sampler = None
+
+
+def enable(path, clock=None, profile=False, profile_interval=0.01):
+    global _tracer, _sampler
+    _tracer = Tracer(path, clock)
+    if profile:
+        _sampler = Sampler(f'{path}.folded', profile_interval)
+        _sampler.start()
+    return _tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, **args):
+    if _tracer is None:
+        return contextlib.nullcontext()
+    return _tracer.span(name, **args)
+
+
+def traced(name):
+    # Decorator that wraps every call to the function in a span.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instant(name, **args):
+    if _tracer is not None:
+        _tracer.instant(name, **args)
+
+
+def close():
+    global _tracer, _sampler
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler.write()
+        logger.info(f'Wrote profile samples to {_sampler.path}')
+        _sampler = None
+    if _tracer is not None:
+        _tracer.flush()
+        logger.info(f'Wrote trace to {_tracer.path}')
+        _tracer = None